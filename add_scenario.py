@@ -1,47 +1,26 @@
 import streamlit as st
-import sqlite3
 import os
-import json
-from groq import Groq
-import re
+from llm_gateway import get_llm_gateway
+from llm_streaming import StreamedCompletion
+from structured_output import SCENARIO_FIELDS, SCENARIO_SCHEMA, generate_object
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 os.environ["GROQ_API_KEY"] = "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"
-client = Groq(api_key=os.environ["GROQ_API_KEY"])
 
-def get_ai_response(message, messages_history, system_prompt):
-    messages = [{"role": "system", "content": system_prompt}] + messages_history + [{"role": "user", "content": message}]
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=messages,
-        temperature=0.7,
-        max_tokens=1000
+def complete_messages(messages):
+    return get_llm_gateway().complete(
+        "llama3-70b-8192", messages, temperature=0.7, max_tokens=1000, purpose="scenario_generation"
     )
-    return response.choices[0].message.content.strip()
-
-def extract_json_block(text):
-    match = re.search(r'\{.*\}', text, re.DOTALL)
-    if match:
-        return match.group(0)
-    return None
 
-# Ensure the scenarios table exists in your SQLite database.
-conn = sqlite3.connect("database.db")
-cursor = conn.cursor()
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS scenarios (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        conversation_type TEXT,
-        persona_ai TEXT,
-        persona_user TEXT,
-        scenario_description TEXT,
-        system_prompt TEXT,
-        evaluation_criteria TEXT,
-        business_role TEXT
-    )
-""")
-conn.commit()
+def get_ai_response(message, messages_history, system_prompt, stream=False):
+    """Full reply text, or with stream=True a StreamedCompletion to render as it arrives."""
+    messages = [{"role": "system", "content": system_prompt}] + messages_history + [{"role": "user", "content": message}]
+    if stream:
+        return StreamedCompletion(
+            get_llm_gateway(), messages, model="llama3-70b-8192", temperature=0.7, max_tokens=1000,
+            purpose="scenario_generation"
+        )
+    return complete_messages(messages)
 
 def run_generate_scenario_module(conn, cursor):
     st.title("Customer Service Agent Support Scenario Input")
@@ -100,23 +79,22 @@ def run_generate_scenario_module(conn, cursor):
                 "Use the above as a reference, but generate a new and original scenario."
             )
     
-            try:
-                generated_output = get_ai_response(ai_input, messages_history=[], system_prompt=ai_system_prompt)
-                cleaned_json = extract_json_block(generated_output)
-                if not cleaned_json:
-                    raise ValueError("No JSON block found in AI response.")
-                scenario_data = json.loads(cleaned_json)
-                # Store generated data in session state so that the form fields are pre-filled.
-                st.session_state["name"] = scenario_data.get("name", "")
-                st.session_state["conversation_type"] = scenario_data.get("conversation_type", "")
-                st.session_state["persona_ai"] = scenario_data.get("persona_ai", "")
-                st.session_state["persona_user"] = scenario_data.get("persona_user", "")
-                st.session_state["scenario_description"] = scenario_data.get("scenario_description", "")
-                st.session_state["system_prompt"] = scenario_data.get("system_prompt", "")
-                st.session_state["evaluation_criteria"] = scenario_data.get("evaluation_criteria", "")
+            # Fields that come back valid are kept; only missing or invalid ones are re-requested
+            scenario_data, errors = generate_object(
+                complete_messages,
+                [{"role": "system", "content": ai_system_prompt}, {"role": "user", "content": ai_input}],
+                SCENARIO_SCHEMA
+            )
+            # Store generated data in session state so that the form fields are pre-filled.
+            for field in SCENARIO_FIELDS:
+                st.session_state[field] = scenario_data.get(field, "")
+            missing = [field for field in SCENARIO_FIELDS if field not in scenario_data]
+            if not missing:
                 st.success("Scenario generated successfully!")
-            except Exception as e:
-                st.error("Error generating scenario: " + str(e))
+            elif scenario_data:
+                st.warning("Scenario partially generated. Please fill in: " + ", ".join(missing))
+            else:
+                st.error("Error generating scenario: " + (errors[-1] if errors else "no valid JSON in AI response."))
     
     # --- Form Section ---
     st.header("Scenario Details")
@@ -0,0 +1,174 @@
+# answer_cache.py
+
+import time
+import atexit
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from db_utils import get_connection, migrate_database
+
+# Cosine similarity above which a past query counts as the same question
+SIMILARITY_THRESHOLD = 0.92
+ANSWER_TTL_SECONDS = 7 * 24 * 3600
+MAX_ANSWERS_PER_ROLE = 1000
+# Hit/miss counters and last_used updates are written at most this often
+STATS_FLUSH_SECONDS = 30
+
+
+def _unit(vector):
+    vector = np.asarray(vector, dtype="float32")
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+class SemanticAnswerCache:
+    """
+    Per-business-role cache of assistant answers, looked up by query embedding.
+
+    A query whose embedding is within SIMILARITY_THRESHOLD (cosine) of a cached query
+    for the same role is served the stored answer. Only answers that depend on the
+    role's documents alone belong here (the caller stores job questions asked with no
+    conversation history), since every employee in the role is served them.
+
+    Each entry records the index version it was answered against; entries from an
+    older version of the role's FAISS shards or older than ttl_seconds are never
+    served, and are deleted on the next flush. Lookups are read-only: hit/miss counts
+    and last_used updates are kept in memory and written in one transaction at most
+    every STATS_FLUSH_SECONDS (and on every store), into answer_cache_stats for the HR
+    dashboard.
+    """
+
+    def __init__(self, db_path="database.db", threshold=SIMILARITY_THRESHOLD,
+                 ttl_seconds=ANSWER_TTL_SECONDS, max_entries=MAX_ANSWERS_PER_ROLE):
+        self.db_path = db_path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # Pending writes: role -> {"hits": n, "misses": n}, entry id -> hits, role -> index version
+        self._pending_counts = {}
+        self._pending_hits = {}
+        self._pending_purges = {}
+        self._versions = {}
+        self._last_flush = time.monotonic()
+        self._initialize_db()
+        atexit.register(self.flush)
+
+    def _initialize_db(self):
+        """Ensure the answer_cache and answer_cache_stats tables exist (they are defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "answer_cache"))
+
+    def _count(self, cursor, business_role, column, amount=1):
+        cursor.execute(f'''
+            INSERT INTO answer_cache_stats (business_role, {column}) VALUES (?, ?)
+            ON CONFLICT(business_role) DO UPDATE SET {column} = {column} + excluded.{column}
+        ''', (business_role, amount))
+
+    def lookup(self, business_role, query_vector, index_version) -> Optional[str]:
+        """Return a cached answer for a near-duplicate query, or None (counted as a miss)."""
+        now = time.time()
+        query = _unit(query_vector)
+        rows = get_connection(self.db_path, "answer_cache").execute(
+            "SELECT id, answer, vector FROM answer_cache WHERE business_role = ? AND index_version = ? AND created_at >= ?",
+            (business_role, index_version, now - self.ttl_seconds),
+        ).fetchall()
+        best_id, best_answer = None, None
+        if rows:
+            vectors = np.vstack([np.frombuffer(blob, dtype="float32") for _, _, blob in rows])
+            scores = vectors @ query
+            top = int(np.argmax(scores))
+            if scores[top] >= self.threshold:
+                best_id, best_answer = rows[top][0], rows[top][1]
+
+        with self._lock:
+            counts = self._pending_counts.setdefault(business_role, {"hits": 0, "misses": 0})
+            if best_id is None:
+                counts["misses"] += 1
+            else:
+                counts["hits"] += 1
+                self._pending_hits[best_id] = self._pending_hits.get(best_id, 0) + 1
+            if self._versions.get(business_role) != index_version:
+                self._versions[business_role] = index_version
+                self._pending_purges[business_role] = index_version
+            due = time.monotonic() - self._last_flush >= STATS_FLUSH_SECONDS
+        if due:
+            self.flush()
+        return best_answer
+
+    def store(self, business_role, query, query_vector, index_version, answer):
+        now = time.time()
+        with self._lock, get_connection(self.db_path, "answer_cache") as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO answer_cache (business_role, index_version, query, answer, vector, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (business_role, index_version, query, answer, _unit(query_vector).tobytes(), now, now))
+            # Least recently used entries beyond the per-role limit
+            cursor.execute('''
+                DELETE FROM answer_cache WHERE id IN (
+                    SELECT id FROM answer_cache WHERE business_role = ?
+                    ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+            ''', (business_role, self.max_entries))
+            self._write_pending(cursor, now)
+            conn.commit()
+
+    def flush(self):
+        """Write pending hit/miss counts and last_used updates, and delete stale entries."""
+        with self._lock, get_connection(self.db_path, "answer_cache") as conn:
+            if self._pending_counts or self._pending_hits or self._pending_purges:
+                self._write_pending(conn.cursor(), time.time())
+                conn.commit()
+            self._last_flush = time.monotonic()
+
+    def _write_pending(self, cursor, now):
+        # Called with self._lock held, inside the caller's transaction
+        for business_role, index_version in self._pending_purges.items():
+            cursor.execute(
+                "DELETE FROM answer_cache WHERE business_role = ? AND (index_version != ? OR created_at < ?)",
+                (business_role, index_version, now - self.ttl_seconds),
+            )
+            if cursor.rowcount > 0:
+                self._count(cursor, business_role, "invalidations", cursor.rowcount)
+        cursor.executemany(
+            "UPDATE answer_cache SET last_used = ?, hits = hits + ? WHERE id = ?",
+            [(now, hits, entry_id) for entry_id, hits in self._pending_hits.items()],
+        )
+        for business_role, counts in self._pending_counts.items():
+            for column, amount in counts.items():
+                if amount:
+                    self._count(cursor, business_role, column, amount)
+        self._pending_counts.clear()
+        self._pending_hits.clear()
+        self._pending_purges.clear()
+        self._last_flush = time.monotonic()
+
+    def stats(self) -> Dict:
+        self.flush()
+        with get_connection(self.db_path, "answer_cache") as conn:
+            hits, misses = conn.execute(
+                "SELECT COALESCE(SUM(hits), 0), COALESCE(SUM(misses), 0) FROM answer_cache_stats"
+            ).fetchone()
+            entries = conn.execute("SELECT COUNT(*) FROM answer_cache").fetchone()[0]
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": entries,
+            "hit_rate": hits / total if total else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """Process-wide SemanticAnswerCache singleton."""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = SemanticAnswerCache()
+    return _cache
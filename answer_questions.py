@@ -1,26 +1,20 @@
 import streamlit as st
-import sqlite3
 import json
 from datetime import datetime
 from ask_questions import UserSession
+from db_utils import assigned_items
 
 def run_quiz_module(conn, cursor, logger):
     st.title("Please complete your onboarding quizzes below")
 
-    # 1. Fetch assigned quizzes for the current user from the assignments table.
-    cursor.execute("SELECT quizzes FROM assignments WHERE user_id = ?", (st.session_state.username,))
-    row = cursor.fetchone()
-    if row:
-        # Assuming the 'quizzes' column is stored as a JSON list of quiz names.
-        assigned_quizzes = json.loads(row[0])
-    else:
-        assigned_quizzes = []
+    # 1. Fetch the quizzes assigned to the current user across all of their assignments.
+    assigned_quizzes = assigned_items(cursor, st.session_state.username, "quiz")
 
     # 2. Fetch completed quizzes for the current user from the results table (only those with full marks).
     cursor.execute("""
         SELECT DISTINCT document_title FROM results
-        WHERE id LIKE ? AND score = total
-    """, (f"{st.session_state.username}_%",))
+        WHERE username = ? AND score = total
+    """, (st.session_state.username,))
     completed_documents = {row[0] for row in cursor.fetchall()}
 
     # Filter out quizzes that are already completed.
@@ -86,9 +80,10 @@ def run_quiz_module(conn, cursor, logger):
                     if score == total:
                         quiz_id = f"{st.session_state.username}_{st.session_state.selected_quiz}"
                         cursor.execute("""
-                            INSERT INTO results (id, document_title, score, total, submission_time)
-                            VALUES (?, ?, ?, ?, ?)
-                        """, (quiz_id, st.session_state.selected_quiz, score, total, datetime.now()))
+                            INSERT INTO results (id, username, user_id, document_title, score, total, submission_time)
+                            VALUES (?, ?, (SELECT id FROM users WHERE username = ?), ?, ?, ?, ?)
+                        """, (quiz_id, st.session_state.username, st.session_state.username,
+                              st.session_state.selected_quiz, score, total, datetime.now()))
                         conn.commit()
                         st.success("Congratulations! Full marks achieved. Quiz marked as complete.")
                     else:
@@ -1,59 +1,80 @@
 import streamlit as st
-import sqlite3
 from typing import Dict
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from db_utils import get_connection
+from vector_store import get_vector_service
+from intent_router import get_intent_router
+from llm_streaming import StreamedCompletion
+from answer_cache import get_answer_cache
+from context_builder import build_context
+from chat_memory import ConversationMemory
 
 class OnboardingSystem:
     def __init__(self, client):
         self.client = client
 
-    def get_ai_response(self, message: str, context: Dict) -> str:
-        def classify_query(user_query: str) -> str:
-            system_prompt = (
-                "You are a classifier for an HR onboarding tool. "
-                "Categorize the user input into one of these two categories:\n"
-                "- 'job': For queries about company policies, benefits, work responsibilities, "
-                "or technical skills (e.g., SQL, Python).\n"
-                "- 'general': For greetings, small talk, or other non-job related queries.\n"
-                "Respond with only one word: 'job' or 'general'."
-            )
-            user_message = f"User input: {user_query}\n\nClassify the input:"
-            response = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message},
-                ]
-            )
-            return response.choices[0].message.content.strip().lower()
-
+    def get_ai_response(self, message: str, context: Dict, stream: bool = False, memory=None):
+        """
+        Answer a chat message. A standalone question (no conversation history yet) that
+        near-duplicates an earlier job question from the same role is served from the
+        semantic answer cache. Otherwise, with stream=True a
+        StreamedCompletion is returned for the page to render incrementally; without it
+        the full text. Errors are returned as text. memory (a ConversationMemory) adds the
+        bounded conversation history to the prompt and puts follow-ups in context.
+        """
         try:
-            query_type = classify_query(message)
             job_role = context.get("business_role", "Employee")
+            service = get_vector_service()
+            history = memory.history() if memory else []
+            search_query = memory.contextualize(message) if memory else message
+            # One embedding serves the answer cache, the intent router and retrieval
+            query_vector = service.embeddings.embed_query(search_query)
+            index_version = service.index_version(job_role)
+            answer_cache = get_answer_cache()
+            # The cache is shared by everyone in the role, so only standalone questions use it:
+            # an answer shaped by one employee's conversation must not be served to another
+            cacheable = not history
+            if cacheable:
+                cached_answer = answer_cache.lookup(job_role, query_vector, index_version)
+                if cached_answer is not None:
+                    return cached_answer
+
+            # Routed locally from the query embedding; only ambiguous queries reach the LLM classifier
+            query_type, _ = get_intent_router().route(self.client, search_query, query_vector=query_vector)
+
+            def remember(answer):
+                # Small talk is not grounded in the role's documents and is not shared
+                if cacheable and query_type == "job":
+                    answer_cache.store(job_role, search_query, query_vector, index_version, answer)
             
             if query_type == "job":
-                retrieved_docs = st.session_state.faiss_retriever.get_relevant_documents(message)
-                retrieved_context = "\n\n".join([doc.page_content for doc in retrieved_docs])
+                # Only the caller's role shard and the company-wide shard are searched, fusing
+                # vector similarity with exact-term (BM25) matches; near-duplicate and overlapping
+                # chunks are removed and the rest packed to a fixed token budget
+                retrieved = build_context(service, search_query, job_role, query_vector=query_vector)
                 system_prompt = (
-                    f"You are an HR onboarding assistant. The following context is retrieved from the company's documents:\n\n"
-                    f"{retrieved_context}\n\n"
-                    f"Now answer the user's question related to the role of a {job_role}."
+                    f"You are an HR onboarding assistant. The following numbered excerpts are retrieved from the company's documents:\n\n"
+                    f"{retrieved['context']}\n\n"
+                    f"Now answer the user's question related to the role of a {job_role}. "
+                    f"Cite the excerpts you rely on by number, e.g. [1]."
                 )
             else:
                 system_prompt = "You are a friendly HR onboarding assistant answering general queries and engaging in conversation."
             
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message}
-            ]
-            response = self.client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=messages,
-                temperature=0.7,
-                max_tokens=1000
+            messages = (
+                [{"role": "system", "content": system_prompt}]
+                + history
+                + [{"role": "user", "content": message}]
             )
-            return response.choices[0].message.content
+            if stream:
+                return StreamedCompletion(
+                    self.client, messages, model="llama3-8b-8192", temperature=0.7, max_tokens=1000,
+                    on_complete=remember, purpose="assistant"
+                )
+            answer = self.client.complete(
+                "llama3-8b-8192", messages, temperature=0.7, max_tokens=1000, purpose="assistant"
+            )
+            remember(answer)
+            return answer
         except Exception as e:
             return f"Error: Unable to get response from AI. Details: {str(e)}"
 
@@ -68,21 +89,19 @@ class UserSession:
             ["Business Analyst", "Data Scientist", "Manager", "Other"], 
             index=0
         )
-        conn = sqlite3.connect("database.db")
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
+        # Served from the (business_role, source) index
         cursor.execute(
-            "SELECT DISTINCT metadata FROM processed_docs WHERE business_role = ?", 
+            "SELECT DISTINCT source FROM processed_docs WHERE business_role = ? AND source != ''", 
             (business_role,)
         )
-        docs = cursor.fetchall()
-        document_titles = list({eval(doc[0]).get("source", "") for doc in docs if doc[0]})
+        document_titles = [row[0] for row in cursor.fetchall()]
         
         cursor.execute(
             "SELECT DISTINCT document_title FROM results WHERE business_role = ?", 
             (business_role,)
         )
         completed_docs = [row[0] for row in cursor.fetchall()]
-        conn.close()
         
         total = len(document_titles)
         completed = len(completed_docs)
@@ -103,13 +122,11 @@ def initialize_session_state(client):
         st.session_state.user_session = UserSession("test_user")
     if 'messages' not in st.session_state:
         st.session_state.messages = []
-    if 'faiss_retriever' not in st.session_state:
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-        try:
-            vector_store = FAISS.load_local("faiss_index", embeddings, allow_dangerous_deserialization=True)
-            st.session_state.faiss_retriever = vector_store.as_retriever(search_type="similarity", search_kwargs={"k": 5})
-        except Exception:
-            st.warning("FAISS index not found. Please ensure it's generated correctly.")
+    if 'chat_memory' not in st.session_state:
+        st.session_state.chat_memory = ConversationMemory(client)
+    # The embedding model and index are shared across sessions; this only loads them on first use
+    if not get_vector_service().has_index(st.session_state.user_session.progress["business_role"]):
+        st.warning("FAISS index not found. Please ensure it's generated correctly.")
 
 def run_ask_questions(client, logger):
     st.title("Your HR Onboarding Assistant")
@@ -135,8 +152,25 @@ def run_ask_questions(client, logger):
         )
         
         with st.chat_message("assistant"):
-            response = st.session_state.onboarding_system.get_ai_response(prompt, context)
-            st.markdown(response)
+            reply = st.session_state.onboarding_system.get_ai_response(
+                prompt, context, stream=True, memory=st.session_state.chat_memory
+            )
+            if isinstance(reply, StreamedCompletion):
+                try:
+                    st.write_stream(reply)
+                    response = reply.text
+                except Exception as e:
+                    response = reply.text or f"Error: Unable to get response from AI. Details: {str(e)}"
+                    st.markdown(response)
+                logger.log_event(
+                    user_id=st.session_state.username,
+                    page="AI Assistant",
+                    action="Response Latency",
+                    details=reply.latency_details()
+                )
+            else:
+                response = reply
+                st.markdown(response)
         
         logger.log_event(
             user_id=st.session_state.username,
@@ -146,6 +180,8 @@ def run_ask_questions(client, logger):
         )
         
         st.session_state.messages.append({"role": "assistant", "content": response})
+        if not response.startswith("Error:"):
+            st.session_state.chat_memory.add_turn(prompt, response)
     
     with st.sidebar:
         st.header("Your Learning Progress")
@@ -0,0 +1,113 @@
+# chat_memory.py
+#
+# Bounded conversation memory for the AI Assistant. The last few turns are sent
+# verbatim; older turns are folded into a running summary by a background thread, so
+# summarization never delays an answer and the prompt stays the same size however
+# long the session runs.
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from text_utils import estimate_tokens
+
+SUMMARY_MODEL = "llama3-8b-8192"
+MAX_RECENT_TURNS = 4
+MEMORY_TOKEN_BUDGET = 1500
+SUMMARY_MAX_TOKENS = 300
+# Messages this short are treated as follow-ups and retrieved together with the previous question
+FOLLOW_UP_MAX_WORDS = 6
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a new employee and an HR "
+    "onboarding assistant. Update the summary with the new turns. Keep the facts, names, "
+    "numbers and open questions the employee may refer back to; drop greetings and filler. "
+    "Respond with the updated summary only, in at most 150 words."
+)
+
+_summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+
+
+def summarize_turns(client, summary: str, turns: List[Dict]) -> str:
+    transcript = "\n".join(f"Employee: {t['user']}\nAssistant: {t['assistant']}" for t in turns)
+    return client.complete(
+        SUMMARY_MODEL,
+        [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"Current summary:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}"},
+        ],
+        temperature=0.2,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        purpose="chat_summary",
+    )
+
+
+class ConversationMemory:
+    """
+    Turns are kept in full, but history() only returns the running summary plus as
+    many of the most recent max_recent_turns turns as fit in token_budget. Turns that
+    fall out of the recent window are summarized asynchronously; the updated summary
+    is picked up by the first history() call after it is ready.
+    """
+
+    def __init__(self, client, max_recent_turns=MAX_RECENT_TURNS, token_budget=MEMORY_TOKEN_BUDGET):
+        self.client = client
+        self.max_recent_turns = max_recent_turns
+        self.token_budget = token_budget
+        self.turns = []
+        self.summary = ""
+        self._summarized = 0  # number of leading turns folded into the summary
+        self._pending = None  # (future, turn count it will cover)
+
+    def add_turn(self, user_message: str, assistant_message: str):
+        self.turns.append({"user": user_message, "assistant": assistant_message})
+        self._collect_summary()
+        self._schedule_summary()
+
+    def _schedule_summary(self):
+        fold_upto = len(self.turns) - self.max_recent_turns
+        if self._pending is None and fold_upto > self._summarized:
+            future = _summarizer.submit(
+                summarize_turns, self.client, self.summary, self.turns[self._summarized:fold_upto]
+            )
+            self._pending = (future, fold_upto)
+
+    def _collect_summary(self):
+        if self._pending is None or not self._pending[0].done():
+            return
+        future, fold_upto = self._pending
+        self._pending = None
+        try:
+            self.summary = future.result()
+            self._summarized = fold_upto
+        except Exception:
+            pass  # keep the previous summary; these turns are retried with the next one
+
+    def history(self) -> List[Dict]:
+        """Chat messages to place between the system prompt and the new user message."""
+        self._collect_summary()
+        self._schedule_summary()
+        budget = self.token_budget
+        messages = []
+        if self.summary:
+            budget -= estimate_tokens(self.summary)
+        for turn in reversed(self.turns[-self.max_recent_turns:]):
+            cost = estimate_tokens(turn["user"]) + estimate_tokens(turn["assistant"])
+            if cost > budget:
+                break
+            budget -= cost
+            messages[:0] = [
+                {"role": "user", "content": turn["user"]},
+                {"role": "assistant", "content": turn["assistant"]},
+            ]
+        if self.summary:
+            messages.insert(0, {"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return messages
+
+    def contextualize(self, message: str) -> str:
+        """
+        Query text for retrieval and the answer cache: a short follow-up such as "and for
+        contractors?" is combined with the previous question so it is searched in context.
+        """
+        if self.turns and len(message.split()) <= FOLLOW_UP_MAX_WORDS:
+            return f"{self.turns[-1]['user']} {message}"
+        return message
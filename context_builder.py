@@ -0,0 +1,126 @@
+# context_builder.py
+#
+# Builds the retrieved-context block of the assistant's system prompt. A wider
+# candidate set is retrieved, near-duplicates are suppressed with maximal marginal
+# relevance (MMR), adjacent chunks of the same document are merged with their
+# overlapping text removed, and the result is packed up to a token budget with
+# numbered source citations.
+
+from typing import Dict
+
+import numpy as np
+
+from document_parser import CHUNK_OVERLAP
+from text_utils import estimate_tokens
+
+CONTEXT_TOKEN_BUDGET = 1200
+CANDIDATE_CHUNKS = 20
+# Trade-off between relevance (1.0) and novelty (0.0) when selecting chunks
+MMR_LAMBDA = 0.7
+# Chunks at least this similar to an already selected one are dropped outright
+DUPLICATE_SIMILARITY = 0.95
+
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def mmr_select(query_vector, doc_vectors, limit, lambda_mult=MMR_LAMBDA):
+    """Indices of up to limit documents chosen by MMR, skipping near-duplicates."""
+    if len(doc_vectors) == 0:
+        return []
+    docs = _unit_rows(doc_vectors)
+    relevance = docs @ _unit_rows([query_vector])[0]
+    similarity = docs @ docs.T
+    selected, remaining = [], list(range(len(docs)))
+    while remaining and len(selected) < limit:
+        if selected:
+            redundancy = similarity[np.ix_(remaining, selected)].max(axis=1)
+        else:
+            redundancy = np.zeros(len(remaining))
+        scores = lambda_mult * relevance[remaining] - (1 - lambda_mult) * redundancy
+        best = int(np.argmax(scores))
+        candidate = remaining.pop(best)
+        if redundancy[best] < DUPLICATE_SIMILARITY:
+            selected.append(candidate)
+    return selected
+
+
+def trim_overlap(previous: str, text: str, max_overlap: int = 2 * CHUNK_OVERLAP) -> str:
+    """Drop the start of text that repeats the end of previous (splitter overlap)."""
+    for size in range(min(max_overlap, len(previous), len(text)), 0, -1):
+        if previous.endswith(text[:size]):
+            return text[size:]
+    return text
+
+
+def _merge_adjacent(docs):
+    """
+    Merge chunks that follow each other in the same document into one passage. Returns
+    [(source, page, text)] in the order of each passage's most relevant chunk.
+    """
+    passages = []  # [source, page, last chunk_index, text]
+    by_position = sorted(
+        range(len(docs)),
+        key=lambda i: (docs[i].metadata.get("source", ""), docs[i].metadata.get("chunk_index", 0)),
+    )
+    rank_of_passage = {}
+    for i in by_position:
+        meta = docs[i].metadata
+        source, chunk_index = meta.get("source", ""), meta.get("chunk_index")
+        last = passages[-1] if passages else None
+        if last and source and last[0] == source and chunk_index is not None and last[2] == chunk_index - 1:
+            last[3] = last[3] + trim_overlap(last[3], docs[i].page_content)
+            last[2] = chunk_index
+        else:
+            passages.append([source, meta.get("page"), chunk_index, docs[i].page_content])
+        rank_of_passage[len(passages) - 1] = min(rank_of_passage.get(len(passages) - 1, i), i)
+    order = sorted(range(len(passages)), key=lambda p: rank_of_passage[p])
+    return [(passages[p][0], passages[p][1], passages[p][3]) for p in order]
+
+
+def pack_context(passages, token_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Number and pack passages until the token budget is reached. The passage that
+    crosses the budget is cut at a sentence or word boundary rather than dropped.
+    Returns (context_text, citations).
+    """
+    blocks, citations, used = [], [], 0
+    for source, page, text in passages:
+        label = f"[{len(blocks) + 1}] {source or 'Company document'}" + (f", page {page + 1}" if isinstance(page, int) else "")
+        remaining = token_budget - used - estimate_tokens(label)
+        if remaining <= 20:
+            break
+        if estimate_tokens(text) > remaining:
+            cut = text[:remaining * 4]
+            boundary = max(cut.rfind(". "), cut.rfind(" "))
+            text = cut[:boundary + 1].rstrip() if boundary > 0 else cut
+        block = f"{label}\n{text.strip()}"
+        blocks.append(block)
+        citations.append(label)
+        used += estimate_tokens(block)
+    return "\n\n".join(blocks), citations
+
+
+def build_context(service, query: str, business_role, query_vector=None,
+                  token_budget=CONTEXT_TOKEN_BUDGET, candidates=CANDIDATE_CHUNKS) -> Dict:
+    """
+    Retrieve, deduplicate and pack context for one question. Returns a dict with the
+    context text, its citations and its estimated token count.
+    """
+    if query_vector is None:
+        query_vector = service.embeddings.embed_query(query)
+    docs = service.get_relevant_documents(
+        query, k=candidates, business_role=business_role, query_vector=query_vector
+    )
+    if docs:
+        # Vectors stored at indexing time (embedding cache or shard); chunks with none
+        # keep their retrieval rank after the MMR selection
+        doc_vectors = service.chunk_vectors(docs)
+        with_vectors = [i for i, vector in enumerate(doc_vectors) if vector is not None]
+        selected = mmr_select(query_vector, [doc_vectors[i] for i in with_vectors], limit=len(with_vectors))
+        without_vectors = [i for i, vector in enumerate(doc_vectors) if vector is None]
+        docs = [docs[with_vectors[i]] for i in selected] + [docs[i] for i in without_vectors]
+    context, citations = pack_context(_merge_adjacent(docs), token_budget)
+    return {"context": context, "citations": citations, "tokens": estimate_tokens(context)}
@@ -1,4 +1,4 @@
-import sqlite3
+from db_utils import get_connection, close_connections, initialize_database
 
 # Dummy users data
 dummy_users = {
@@ -9,25 +9,22 @@ dummy_users = {
 }
 
 # Connect to (or create) the database
-conn = sqlite3.connect('database.db')
+conn = get_connection()
 cursor = conn.cursor()
 
-# Create the table if it doesn't already exist
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        username TEXT PRIMARY KEY,
-        password TEXT NOT NULL,
-        system_role TEXT NOT NULL,
-        business_role TEXT NOT NULL
-    )
-''')
+# Create (or upgrade) the tables from the schema migrations
+initialize_database(conn)
 
-# Insert each user into the table. Using INSERT OR REPLACE allows updating if the username already exists.
+# Insert each user into the table, updating users that already exist.
 for username, details in dummy_users.items():
     cursor.execute('''
-        INSERT OR REPLACE INTO users (username, password, system_role, business_role)
+        INSERT INTO users (username, password, system_role, business_role)
         VALUES (?, ?, ?, ?)
+        ON CONFLICT(username) DO UPDATE SET
+            password = excluded.password,
+            system_role = excluded.system_role,
+            business_role = excluded.business_role
     ''', (username, details["password"], details["role"], details["job"]))
 
 conn.commit()
-conn.close()
\ No newline at end of file
+close_connections()
\ No newline at end of file
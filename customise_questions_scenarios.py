@@ -1,25 +1,7 @@
 import streamlit as st
-import re
 import json
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-import tempfile
-import os
-
-def get_ai_response(message, system_prompt, client):
-    messages = [{"role": "system", "content": system_prompt}] + [{"role": "user", "content": message}]
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=messages,
-        temperature=0.7,
-        max_tokens=1000
-    )
-    return response.choices[0].message.content.strip()
-
-def extract_json_block(text):
-    match = re.search(r'\{.*\}', text, re.DOTALL)
-    if match:
-        return match.group(0)
-    return None
+from resume_pipeline import ResumePipeline, file_hash
+from db_utils import create_assignment
 
 def run_assignments(conn, cursor, client, logger):
     st.title("Assignment Creator")
@@ -27,40 +9,35 @@ def run_assignments(conn, cursor, client, logger):
     # --- Resume Upload Section ---
     uploaded_resume = st.file_uploader("Upload your resume (PDF or DOC/DOCX)", type=["pdf", "doc", "docx"])
     resume_summary = ""
+    resume_hash = None
+    # Parsing, summary and recommendations are stored by file content hash, so reruns
+    # (e.g. toggling a checkbox) and other admins reuse them instead of calling the LLM again.
+    # Failed or incomplete results are kept for this session too, with their errors, and
+    # only retried from the Retry buttons.
+    pipeline = ResumePipeline()
+    if "resume_results" not in st.session_state:
+        st.session_state.resume_results = {}
+    results = st.session_state.resume_results
 
     if uploaded_resume is not None:
-        resume_text = ""
-        file_type = uploaded_resume.name.split('.')[-1].lower()
-
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
-            tmp_file.write(uploaded_resume.read())
-            tmp_path = tmp_file.name
-
-        try:
-            if file_type == "pdf":
-                loader = PyPDFLoader(tmp_path)
-            elif file_type in ["doc", "docx"]:
-                loader = Docx2txtLoader(tmp_path)
-            else:
-                st.error("Unsupported file type.")
-                loader = None
-
-            if loader:
-                docs = loader.load()
-                resume_text = "\n".join(doc.page_content for doc in docs)
-
-        except Exception as e:
-            st.error(f"Error loading resume: {e}")
-        finally:
-            os.remove(tmp_path)
-
-        if resume_text:
-            system_prompt = (
-                "Summarize the resume by highlighting the user's skillset, "
-                "technical skills, and experience level."
-            )
-            resume_summary = get_ai_response(resume_text, system_prompt, client)
+        data = uploaded_resume.getvalue()
+        resume_hash = file_hash(data)
+        summary_key = ("summary", resume_hash)
+        if summary_key not in results:
+            try:
+                results[summary_key] = (pipeline.summarize(client, uploaded_resume.name, data)[1], None)
+            except ValueError as e:
+                results[summary_key] = ("", str(e))
+            except Exception as e:
+                results[summary_key] = ("", f"Error loading resume: {e}")
+        resume_summary, summary_error = results[summary_key]
+        if summary_error:
+            st.error(summary_error)
+            if st.button("Retry resume analysis"):
+                del results[summary_key]
+                st.rerun()
+
+        if resume_summary:
             st.text_area("Resume Summary", value=resume_summary, height=500)
     
     # --- Existing Assignment Creation Code ---
@@ -105,33 +82,27 @@ def run_assignments(conn, cursor, client, logger):
     recommended_scenarios = []
     recommended_reason = ""
     if resume_summary:
-        recommendation_prompt = (
-            "Based on the resume summary below, recommend which quizzes and scenarios are most relevant. "
-            "The resume summary is:\n"
-            f"{resume_summary}\n\n"
-            "Available Quizzes (Document Titles):\n"
-            f"{', '.join(available_quizzes)}\n\n"
-            "Available Scenarios:\n"
-            f"{', '.join(available_scenarios)}\n\n"
-            "Return a JSON object with three keys: 'quizzes', 'scenarios', and 'reason'. "
-            "The 'quizzes' and 'scenarios' values should be lists of items from the available options that should be auto-selected, "
-            "and 'reason' should be the reason for the recommendations."
-        )
-        recommendation_response = get_ai_response(
-            recommendation_prompt,
-            "You are an assistant that recommends relevant quizzes and scenarios based on a resume.",
-            client
+        recommendation_key = (
+            "recommendation", resume_hash, selected_business_role,
+            tuple(sorted(available_quizzes)), tuple(sorted(available_scenarios)),
         )
-        cleaned_json = extract_json_block(recommendation_response)
-        if not cleaned_json:
-            raise ValueError("No JSON block found in AI response.")
-        try:
-            rec_data = json.loads(cleaned_json)
-            recommended_quizzes = rec_data.get("quizzes", [])
-            recommended_scenarios = rec_data.get("scenarios", [])
-            recommended_reason = rec_data.get("reason", "No recommendation reason provided.")
-        except Exception as e:
-            st.error(f"Error parsing recommendations: {e}")
+        if recommendation_key not in results:
+            results[recommendation_key] = pipeline.recommend(
+                client, resume_hash, resume_summary, selected_business_role, available_quizzes, available_scenarios
+            )
+        rec_data, errors = results[recommendation_key]
+        recommended_quizzes = rec_data.get("quizzes", [])
+        recommended_scenarios = rec_data.get("scenarios", [])
+        recommended_reason = rec_data.get("reason", "No recommendation reason provided.")
+        if len(rec_data) < 3:
+            st.error(f"Error parsing recommendations: {errors[-1] if errors else 'no valid JSON in AI response.'}")
+            if st.button("Retry recommendation"):
+                # Only the missing keys are requested again
+                results[recommendation_key] = pipeline.recommend(
+                    client, resume_hash, resume_summary, selected_business_role,
+                    available_quizzes, available_scenarios, partial=rec_data
+                )
+                st.rerun()
 
         # Display the extracted reason for recommendation
         st.text_area("Recommendation Reason", value=recommended_reason, height=150)
@@ -163,28 +134,13 @@ def run_assignments(conn, cursor, client, logger):
 
     # Step 6: Submit button to save the assignment into a new table
     if st.button("Assign"):
-        # Create the assignments table if it doesn't exist
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS assignments (
-                id INTEGER PRIMARY KEY,
-                user_id TEXT,
-                quizzes TEXT,
-                scenarios TEXT
-            )
-        ''')
+        # Insert the new assignment record with one assignment_items row per quiz and scenario
+        create_assignment(cursor, selected_username, selected_quizzes, selected_scenarios)
         conn.commit()
 
-        # Convert the selected quizzes and scenarios to JSON lists
         quizzes_json = json.dumps(selected_quizzes)
         scenarios_json = json.dumps(selected_scenarios)
         
-        # Insert the new assignment record
-        cursor.execute('''
-            INSERT INTO assignments (user_id, quizzes, scenarios)
-            VALUES (?, ?, ?)
-        ''', (selected_username, quizzes_json, scenarios_json))
-        conn.commit()
-        
         st.success("Assignment created successfully!")
         logger.log_event(
             user_id=st.session_state.username,  # or use selected_username if appropriate
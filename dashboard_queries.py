@@ -0,0 +1,195 @@
+# dashboard_queries.py
+#
+# Data access for the HR dashboard. Every metric is aggregated in SQLite (GROUP BY,
+# COUNT, AVG, date() buckets) and only the small result a widget renders comes back
+# as a DataFrame, so dashboard memory and load time do not grow with the history in
+# results and chat_logs. The business role filter is bound as a query parameter.
+
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+SCORE_BINS = 10
+TOP_QUERIES = 10
+DEFAULT_DEADLINE_DAYS = 7
+
+# Users with the documents of their business role they have not passed yet. Required
+# documents are the ones that have questions; NOT EXISTS is served from the
+# (username, document_title) results index.
+_MISSING_DOCUMENTS = '''
+    WITH required AS (
+        SELECT DISTINCT business_role, document_title FROM questions
+    ),
+    missing AS (
+        SELECT u.id AS user_pk, group_concat(r.document_title, ', ') AS missing_documents
+        FROM users u
+        JOIN required r ON r.business_role = u.business_role
+        WHERE NOT EXISTS (
+            SELECT 1 FROM results s WHERE s.username = u.username AND s.document_title = r.document_title
+        )
+        GROUP BY u.id
+    )
+'''
+
+
+def _role_filter(column: str, business_role: Optional[str], keyword: str = "WHERE") -> Tuple[str, List]:
+    """SQL condition and parameters restricting column to business_role; none for all roles."""
+    if business_role is None:
+        return "", []
+    return f" {keyword} {column} = ?", [business_role]
+
+
+def result_roles(conn) -> List[str]:
+    rows = conn.execute(
+        "SELECT DISTINCT business_role FROM results WHERE business_role IS NOT NULL ORDER BY business_role"
+    ).fetchall()
+    return [row[0] for row in rows]
+
+
+def deadline_days(conn) -> int:
+    row = conn.execute("SELECT value FROM settings WHERE key = 'quiz_deadline_days'").fetchone()
+    return int(row[0]) if row else DEFAULT_DEADLINE_DAYS
+
+
+def key_metrics(conn, business_role: Optional[str] = None) -> Dict:
+    """Documents with questions, completed quizzes, average score and chat queries logged."""
+    where, params = _role_filter("business_role", business_role)
+    documents = conn.execute(f"SELECT COUNT(DISTINCT document_title) FROM questions{where}", params).fetchone()[0]
+    completed, average = conn.execute(f"SELECT COUNT(*), AVG(score) FROM results{where}", params).fetchone()
+    chat_queries = conn.execute(f"SELECT COUNT(*) FROM chat_logs{where}", params).fetchone()[0]
+    return {
+        "documents": documents,
+        "quizzes_completed": completed,
+        "average_score": average,
+        "chat_queries": chat_queries,
+    }
+
+
+def answer_cache_stats(conn, business_role: Optional[str] = None) -> pd.DataFrame:
+    where, params = _role_filter("business_role", business_role)
+    return pd.read_sql_query(
+        f"SELECT business_role, hits, misses, invalidations FROM answer_cache_stats{where}", conn, params=params
+    )
+
+
+def chat_volume_by_day(conn, business_role: Optional[str] = None) -> pd.DataFrame:
+    where, params = _role_filter("business_role", business_role)
+    return pd.read_sql_query(f'''
+        SELECT date(timestamp) AS timestamp, COUNT(*) AS Messages
+        FROM chat_logs{where}
+        GROUP BY date(timestamp)
+        ORDER BY date(timestamp)
+    ''', conn, params=params)
+
+
+def top_chat_queries(conn, business_role: Optional[str] = None, limit: int = TOP_QUERIES) -> pd.DataFrame:
+    where, params = _role_filter("business_role", business_role)
+    return pd.read_sql_query(f'''
+        SELECT message AS Query, COUNT(*) AS Count
+        FROM chat_logs{where}
+        GROUP BY message
+        ORDER BY Count DESC, message
+        LIMIT ?
+    ''', conn, params=params + [limit])
+
+
+def overdue_users(conn, days: int) -> pd.DataFrame:
+    """Users who still owe documents, with their deadline and OVERDUE/PENDING status."""
+    return pd.read_sql_query(_MISSING_DOCUMENTS + '''
+        SELECT
+            u.username AS Username,
+            u.business_role AS Role,
+            u.department AS Department,
+            date(u.start_date) AS "Start Date",
+            date(u.start_date, '+' || ? || ' days') AS Deadline,
+            m.missing_documents AS "Missing Documents",
+            CASE WHEN datetime('now', 'localtime') > datetime(u.start_date, '+' || ? || ' days')
+                 THEN 'OVERDUE' ELSE 'PENDING' END AS Status
+        FROM users u
+        JOIN missing m ON m.user_pk = u.id
+        ORDER BY Status, Deadline, u.username
+    ''', conn, params=[days, days])
+
+
+def completion_by_role(conn) -> pd.DataFrame:
+    """Users per business role and how many of them have passed every required document."""
+    return pd.read_sql_query(_MISSING_DOCUMENTS + '''
+        SELECT
+            u.business_role AS "Business Role",
+            COUNT(*) AS "Total Users",
+            SUM(m.user_pk IS NULL) AS "Completed Users",
+            ROUND(100.0 * SUM(m.user_pk IS NULL) / COUNT(*), 2) AS "Completion Rate (%)"
+        FROM users u
+        LEFT JOIN missing m ON m.user_pk = u.id
+        GROUP BY u.business_role
+        ORDER BY u.business_role
+    ''', conn)
+
+
+def completions_by_document(conn, business_role: Optional[str] = None) -> pd.DataFrame:
+    where, params = _role_filter("business_role", business_role)
+    return pd.read_sql_query(f'''
+        SELECT business_role AS "Business Role", document_title AS "Document Title", COUNT(*) AS Completions
+        FROM results{where}
+        GROUP BY business_role, document_title
+        ORDER BY business_role, document_title
+    ''', conn, params=params)
+
+
+def average_score_by_document(conn, business_role: Optional[str] = None) -> pd.DataFrame:
+    where, params = _role_filter("business_role", business_role)
+    return pd.read_sql_query(f'''
+        SELECT document_title AS Document, ROUND(AVG(score), 2) AS "Average Score"
+        FROM results{where}
+        GROUP BY document_title
+        ORDER BY document_title
+    ''', conn, params=params)
+
+
+def score_distribution(conn, business_role: str, bins: int = SCORE_BINS) -> pd.DataFrame:
+    """
+    Number of results per score range, using the same equal-width bins over
+    [min, max] as numpy.histogram. Empty if the role has no results.
+    """
+    low, high = conn.execute(
+        "SELECT MIN(score), MAX(score) FROM results WHERE business_role = ?", (business_role,)
+    ).fetchone()
+    if low is None:
+        return pd.DataFrame(columns=["Score Range", "Number of Users"])
+    low, high = float(low), float(high)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    width = (high - low) / bins
+    rows = conn.execute('''
+        SELECT MIN(CAST((score - ?) / ? AS INTEGER), ?) AS bin, COUNT(*)
+        FROM results WHERE business_role = ?
+        GROUP BY bin
+    ''', (low, width, bins - 1, business_role)).fetchall()
+    counts = dict(rows)
+    edges = [low + i * width for i in range(bins + 1)]
+    return pd.DataFrame({
+        "Score Range": [f"{int(edges[i])}-{int(edges[i + 1])}" for i in range(bins)],
+        "Number of Users": [counts.get(i, 0) for i in range(bins)],
+    })
+
+
+def quiz_stats_by_department(conn, business_role: Optional[str] = None) -> pd.DataFrame:
+    where, params = _role_filter("r.business_role", business_role, keyword="AND")
+    return pd.read_sql_query(f'''
+        SELECT u.department AS Department, COUNT(*) AS "Quizzes Completed", ROUND(AVG(r.score), 2) AS "Average Score"
+        FROM results r
+        JOIN users u ON u.username = r.username
+        WHERE u.department IS NOT NULL{where}
+        GROUP BY u.department
+        ORDER BY u.department
+    ''', conn, params=params)
+
+
+def submissions_by_day(conn, business_role: Optional[str] = None) -> pd.DataFrame:
+    where, params = _role_filter("business_role", business_role)
+    return pd.read_sql_query(f'''
+        SELECT date(submission_time) AS submission_time, COUNT(*) AS Submissions
+        FROM results{where}
+        GROUP BY date(submission_time)
+        ORDER BY date(submission_time)
+    ''', conn, params=params)
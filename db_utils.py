@@ -1,21 +1,263 @@
 # db_utils.py
 
+import os
 import sqlite3
+import hashlib
+import json
+import ast
+import functools
+import threading
+
+DB_PATH = "database.db"
+# Applied to every connection handed out by get_connection()
+BUSY_TIMEOUT_MS = 30_000
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+
+def connect(db_name=DB_PATH):
+    """
+    Open a new connection in WAL mode, so readers never block the single writer and
+    vice versa, with synchronous=NORMAL (safe under WAL), a busy timeout instead of
+    an immediate "database is locked", memory-mapped reads and a larger page cache.
+    """
+    conn = sqlite3.connect(
+        db_name,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        check_same_thread=False,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KIB}")
+    return conn
+
+
+def get_connection(db_name=DB_PATH, channel="main"):
+    """
+    Return this thread's connection to db_name, opening it on first use.
+
+    Connections live for the lifetime of the thread, so each thread keeps its own
+    prepared statement cache and never shares a connection (or its transaction)
+    with another thread. Do not close them; use `with conn:` to commit.
+
+    Stores that commit on their own (logger, caches, metrics) pass their own channel
+    so their commits never end a transaction the caller has open on "main".
+    """
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    key = (os.path.abspath(db_name), channel)
+    conn = connections.get(key)
+    if conn is None:
+        conn = connections[key] = connect(db_name)
+    return conn
+
+
+def close_connections():
+    """Close every connection opened by the current thread (for scripts that exit)."""
+    connections = getattr(_local, "connections", None) or {}
+    for conn in connections.values():
+        conn.close()
+    connections.clear()
+
+
+class SchemaError(RuntimeError):
+    """The database schema is not one this version of the app knows how to use."""
+
+
+# Database files already migrated and checked by this process
+_initialized = set()
+_initialized_lock = threading.Lock()
 
-def get_connection(db_name='database.db'):
-    return sqlite3.connect(db_name, check_same_thread=False)
 
 def initialize_database(conn):
-    cursor = conn.cursor()
+    """
+    Apply pending schema migrations, then refuse to continue on an unrecognized schema.
+    Done once per database file and process; Streamlit calls this on every rerun.
+    """
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+    if db_file not in _initialized:
+        with _initialized_lock:
+            if db_file not in _initialized:
+                migrate_database(conn)
+                check_schema(conn)
+                if db_file:  # in-memory databases are new on every connection
+                    _initialized.add(db_file)
+    return conn, conn.cursor()
+
+
+def _parse_legacy_metadata(metadata):
+    # Rows written before metadata was stored as JSON hold str(dict)
+    if not metadata:
+        return {}
+    try:
+        return json.loads(metadata)
+    except ValueError:
+        try:
+            return ast.literal_eval(metadata)
+        except (ValueError, SyntaxError):
+            return {}
+
+
+def _upgrade_processed_docs(cursor):
+    """
+    Bring processed_docs created by older versions up to date: add and backfill the
+    content_hash, source, page and chunk_index columns and rewrite metadata as JSON.
+    """
+    cursor.execute("PRAGMA table_info(processed_docs)")
+    columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in [("content_hash", "TEXT"), ("source", "TEXT"), ("page", "INTEGER"), ("chunk_index", "INTEGER")]:
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE processed_docs ADD COLUMN {column} {column_type}")
+
+    cursor.execute("SELECT id, page_content FROM processed_docs WHERE content_hash IS NULL")
+    rows = cursor.fetchall()
+    cursor.executemany(
+        "UPDATE processed_docs SET content_hash = ? WHERE id = ?",
+        [(hashlib.sha256((text or "").encode("utf-8")).hexdigest(), row_id) for row_id, text in rows]
+    )
+
+    cursor.execute("SELECT id, metadata, business_role FROM processed_docs WHERE source IS NULL ORDER BY id")
+    updates = []
+    chunk_counters = {}
+    for row_id, metadata, business_role in cursor.fetchall():
+        parsed = _parse_legacy_metadata(metadata)
+        source = parsed.get("source", "")
+        chunk_index = chunk_counters.get((business_role, source), 0)
+        chunk_counters[(business_role, source)] = chunk_index + 1
+        updates.append((json.dumps(parsed, default=str), source, parsed.get("page"), chunk_index, row_id))
+    cursor.executemany(
+        "UPDATE processed_docs SET metadata = ?, source = ?, page = ?, chunk_index = ? WHERE id = ?",
+        updates
+    )
 
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_processed_docs_role_hash ON processed_docs (business_role, content_hash)"
+    )
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_processed_docs_role_source ON processed_docs (business_role, source)"
+    )
+
+
+def _create_processed_docs_fts(cursor):
+    """
+    FTS5 shadow table over processed_docs.page_content for lexical (BM25) retrieval.
+    Triggers keep it in sync with every insert, update and delete at ingest.
+
+    Optional: on SQLite builds without FTS5 neither the table nor the triggers are
+    created, and retrieval falls back to vector search alone.
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'processed_docs_fts'")
+    exists = cursor.fetchone() is not None
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS processed_docs_fts USING fts5(
+                page_content,
+                content='processed_docs',
+                content_rowid='id',
+                tokenize='porter unicode61'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        if "no such module: fts5" in str(e):
+            return
+        raise SchemaError(f"Could not create the processed_docs full-text index: {e}") from e
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processed_docs_fts_insert AFTER INSERT ON processed_docs BEGIN
+            INSERT INTO processed_docs_fts (rowid, page_content) VALUES (new.id, new.page_content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processed_docs_fts_delete AFTER DELETE ON processed_docs BEGIN
+            INSERT INTO processed_docs_fts (processed_docs_fts, rowid, page_content) VALUES ('delete', old.id, old.page_content);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS processed_docs_fts_update AFTER UPDATE OF page_content ON processed_docs BEGIN
+            INSERT INTO processed_docs_fts (processed_docs_fts, rowid, page_content) VALUES ('delete', old.id, old.page_content);
+            INSERT INTO processed_docs_fts (rowid, page_content) VALUES (new.id, new.page_content);
+        END
+    ''')
+    if not exists:
+        # Index the chunks stored before the table existed
+        cursor.execute("INSERT INTO processed_docs_fts (processed_docs_fts) VALUES ('rebuild')")
+
+
+def _rebuild_legacy_users(cursor):
+    # create_dummy_users.py used to create users keyed by username, without id, department or start_date
+    cursor.execute("PRAGMA table_info(users)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if not columns or "id" in columns:
+        return
+    cursor.execute("ALTER TABLE users RENAME TO users_legacy")
+    _create_users(cursor)
+    cursor.execute('''
+        INSERT INTO users (username, password, system_role, business_role)
+        SELECT username, password, system_role, business_role FROM users_legacy
+    ''')
+    cursor.execute("DROP TABLE users_legacy")
+
+
+def _create_users(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            username TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            system_role TEXT NOT NULL,
+            business_role TEXT NOT NULL,
+            department TEXT,
+            start_date TEXT
+        )
+    ''')
+
+
+# ----------------------- Schema migrations -----------------------
+def _rebuild_table(cursor, table, create_sql):
+    """
+    Recreate table from create_sql (with a {table} placeholder for its name), copying
+    the columns old and new have in common and restoring the table's indexes. Drops
+    columns portably: ALTER TABLE ... DROP COLUMN needs SQLite 3.35 or newer.
+    """
+    new_table = f"{table}_new"
+    cursor.execute(create_sql.format(table=new_table))
+    old_columns = {row[1] for row in cursor.execute(f'PRAGMA table_info("{table}")').fetchall()}
+    columns = ", ".join(
+        f'"{row[1]}"' for row in cursor.execute(f'PRAGMA table_info("{new_table}")').fetchall()
+        if row[1] in old_columns
+    )
+    indexes = [row[0] for row in cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+    ).fetchall()]
+    cursor.execute(f'INSERT INTO "{new_table}" ({columns}) SELECT {columns} FROM "{table}"')
+    cursor.execute(f'DROP TABLE "{table}"')
+    cursor.execute(f'ALTER TABLE "{new_table}" RENAME TO "{table}"')
+    for sql in indexes:
+        cursor.execute(sql)
+
+
+def _migration_1_baseline(cursor):
+    """Core tables as they existed before versioning; adopts databases created by older versions."""
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS processed_docs (
             id INTEGER PRIMARY KEY,
             page_content TEXT,
             metadata TEXT,
-            business_role TEXT
+            business_role TEXT,
+            content_hash TEXT,
+            source TEXT,
+            page INTEGER,
+            chunk_index INTEGER
         )
     ''')
+    _upgrade_processed_docs(cursor)
+    _create_processed_docs_fts(cursor)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS questions (
             id INTEGER PRIMARY KEY,
@@ -36,17 +278,8 @@ def initialize_database(conn):
             submission_time TEXT
         )
     ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            system_role TEXT NOT NULL,
-            business_role TEXT NOT NULL,
-            department TEXT,
-            start_date TEXT
-        )
-    ''')
+    _rebuild_legacy_users(cursor)
+    _create_users(cursor)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS logs (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -73,9 +306,374 @@ def initialize_database(conn):
             value TEXT
         )
     ''')
-    cursor.execute("SELECT * FROM settings WHERE key = 'quiz_deadline_days'")
-    if cursor.fetchone() is None:
-        cursor.execute("INSERT INTO settings (key, value) VALUES (?, ?)", ("quiz_deadline_days", "7"))
+    cursor.execute("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)", ("quiz_deadline_days", "7"))
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scenarios (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT,
+            conversation_type TEXT,
+            persona_ai TEXT,
+            persona_user TEXT,
+            scenario_description TEXT,
+            system_prompt TEXT,
+            evaluation_criteria TEXT,
+            business_role TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assignments (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT,
+            quizzes TEXT,
+            scenarios TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS chat_logs (
+            id TEXT,
+            business_role TEXT,
+            message TEXT,
+            timestamp TEXT
+        )
+    ''')
+
+
+def _migration_2_lookup_indexes(cursor):
+    """Indexes for the per-request lookups; users.username is already covered by its UNIQUE constraint."""
+    # Quiz page: questions of one document
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_document ON questions (document_title)")
+    # Assignment creator: quizzes on offer for a business role
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_questions_role_document ON questions (business_role, document_title)")
+    # Quiz page and scenario trainer: a user's assignments
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_assignments_user ON assignments (user_id)")
+    # Assignment creator: scenarios on offer for a business role
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_scenarios_role ON scenarios (business_role, name, conversation_type)"
+    )
+
+
+def _migration_3_normalize_results_and_assignments(cursor):
+    """
+    results: add username/user_id instead of recovering the user from the
+    "<username>_<document>" id. assignments: move the JSON lists of quiz and
+    scenario names into assignment_items, one row per assigned item.
+    """
+    cursor.execute("ALTER TABLE results ADD COLUMN username TEXT")
+    cursor.execute("ALTER TABLE results ADD COLUMN user_id INTEGER")
+    # Longest matching username wins, so "jane_doe_Policy" belongs to jane_doe and not jane;
+    # ids of users that no longer exist fall back to the text before the first underscore
+    cursor.execute('''
+        UPDATE results SET username = COALESCE(
+            (SELECT u.username FROM users u
+             WHERE substr(results.id, 1, length(u.username) + 1) = u.username || '_'
+             ORDER BY length(u.username) DESC LIMIT 1),
+            CASE WHEN instr(id, '_') > 0 THEN substr(id, 1, instr(id, '_') - 1) ELSE id END
+        )
+    ''')
+    cursor.execute("UPDATE results SET user_id = (SELECT u.id FROM users u WHERE u.username = results.username)")
+    # Quiz page: a user's completed quizzes; covers the columns the query reads
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_results_username ON results (username, document_title, score, total)"
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_results_user_id ON results (user_id, document_title)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assignment_items (
+            id INTEGER PRIMARY KEY,
+            assignment_id INTEGER NOT NULL REFERENCES assignments (id),
+            item_type TEXT NOT NULL CHECK (item_type IN ('quiz', 'scenario')),
+            item_name TEXT NOT NULL,
+            UNIQUE (assignment_id, item_type, item_name)
+        )
+    ''')
+    cursor.execute("SELECT id, quizzes, scenarios FROM assignments")
+    items = []
+    for assignment_id, quizzes, scenarios in cursor.fetchall():
+        for item_type, names in (("quiz", quizzes), ("scenario", scenarios)):
+            try:
+                names = json.loads(names) if names else []
+            except ValueError:
+                names = []
+            items.extend((assignment_id, item_type, name) for name in names if isinstance(name, str))
+    cursor.executemany(
+        "INSERT OR IGNORE INTO assignment_items (assignment_id, item_type, item_name) VALUES (?, ?, ?)", items
+    )
+    # Without the quizzes and scenarios columns
+    _rebuild_table(cursor, "assignments", '''
+        CREATE TABLE {table} (
+            id INTEGER PRIMARY KEY,
+            user_id TEXT
+        )
+    ''')
+    # Served from idx_assignments_user, then this index: a user's items of one type
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_assignment_items_assignment ON assignment_items (assignment_id, item_type, item_name)"
+    )
+
+
+def _migration_4_dashboard_indexes(cursor):
+    """Covering indexes for the HR dashboard aggregates (dashboard_queries.py)."""
+    # Per-role counts, averages, score ranges and per-document summaries; also serves
+    # the chatbot sidebar progress query (completed documents per business role)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_results_role_summary ON results (business_role, document_title, score)"
+    )
+    # Chat volume per day and top queries for one role
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chat_logs_role_time ON chat_logs (business_role, timestamp)")
+
+
+def _migration_5_auxiliary_stores(cursor):
+    """
+    Tables of the caches, metrics and job stores that used to create their own on
+    first use; adopts the existing ones. Resumes keep only their hash, file name and summary.
+    """
+    # embedding_cache.CachedEmbeddings
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            model_name TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            last_used TEXT,
+            PRIMARY KEY (model_name, content_hash)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_last_used ON embedding_cache (last_used)")
+    # llm_cache.LLMResponseCache
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS llm_response_cache (
+            request_key TEXT PRIMARY KEY,
+            model TEXT,
+            response TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            created_at REAL,
+            last_used REAL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_used ON llm_response_cache (last_used)")
+    # llm_gateway.LLMGateway
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS llm_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            model TEXT,
+            purpose TEXT,
+            status TEXT,
+            attempts INTEGER,
+            latency_ms REAL,
+            ttft_ms REAL,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            error TEXT
+        )
+    ''')
+    # answer_cache.SemanticAnswerCache
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            business_role TEXT NOT NULL,
+            index_version TEXT NOT NULL,
+            query TEXT,
+            answer TEXT,
+            vector BLOB NOT NULL,
+            created_at REAL,
+            last_used REAL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_role ON answer_cache (business_role, last_used)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS answer_cache_stats (
+            business_role TEXT PRIMARY KEY,
+            hits INTEGER DEFAULT 0,
+            misses INTEGER DEFAULT 0,
+            invalidations INTEGER DEFAULT 0
+        )
+    ''')
+    # intent_router.IntentRouter
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS intent_routes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT,
+            query TEXT,
+            intent TEXT,
+            method TEXT,
+            margin REAL,
+            local_intent TEXT,
+            llm_intent TEXT,
+            route_ms REAL
+        )
+    ''')
+    # ingestion_jobs.IngestionQueue
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingestion_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            business_role TEXT,
+            created_by TEXT,
+            status TEXT,
+            worker_pid INTEGER,
+            error TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ingestion_files (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER,
+            file_name TEXT,
+            file_path TEXT,
+            stage TEXT,
+            error TEXT,
+            chunks INTEGER,
+            questions TEXT,
+            updated_at TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_jobs_status ON ingestion_jobs (status)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_files_job ON ingestion_files (job_id)")
+    # resume_pipeline.ResumePipeline
+    resume_analyses = '''
+        CREATE TABLE IF NOT EXISTS {table} (
+            content_hash TEXT PRIMARY KEY,
+            file_name TEXT,
+            summary TEXT,
+            created_at REAL
+        )
+    '''
+    cursor.execute("PRAGMA table_info(resume_analyses)")
+    if "resume_text" in {row[1] for row in cursor.fetchall()}:
+        _rebuild_table(cursor, "resume_analyses", resume_analyses)
+    else:
+        cursor.execute(resume_analyses.format(table="resume_analyses"))
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS resume_recommendations (
+            content_hash TEXT NOT NULL,
+            business_role TEXT NOT NULL,
+            options_hash TEXT NOT NULL,
+            recommendation TEXT,
+            created_at REAL,
+            PRIMARY KEY (content_hash, business_role, options_hash)
+        )
+    ''')
+
+
+def _migration_6_ingestion_progress(cursor):
+    """Parse progress of a running ingestion job, counted in page-range parts."""
+    cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN parsed_parts INTEGER")
+    cursor.execute("ALTER TABLE ingestion_jobs ADD COLUMN total_parts INTEGER")
+
+
+def create_assignment(cursor, username, quizzes, scenarios):
+    """Insert an assignment for username with its quiz and scenario names; the caller commits."""
+    cursor.execute("INSERT INTO assignments (user_id) VALUES (?)", (username,))
+    assignment_id = cursor.lastrowid
+    cursor.executemany(
+        "INSERT OR IGNORE INTO assignment_items (assignment_id, item_type, item_name) VALUES (?, ?, ?)",
+        [(assignment_id, "quiz", name) for name in quizzes] + [(assignment_id, "scenario", name) for name in scenarios]
+    )
+    return assignment_id
+
+
+def assigned_items(cursor, username, item_type):
+    """Names of every quiz or scenario assigned to username, across all of their assignments, in assignment order."""
+    cursor.execute('''
+        SELECT i.item_name FROM assignments a
+        JOIN assignment_items i ON i.assignment_id = a.id
+        WHERE a.user_id = ? AND i.item_type = ?
+        GROUP BY i.item_name
+        ORDER BY MIN(i.id)
+    ''', (username, item_type))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Applied in order; PRAGMA user_version records how many have run. Never edit a
+# released migration, append a new one instead.
+MIGRATIONS = [
+    (1, "baseline schema", _migration_1_baseline),
+    (2, "indexes for hot lookup paths", _migration_2_lookup_indexes),
+    (3, "results.username/user_id and assignment_items", _migration_3_normalize_results_and_assignments),
+    (4, "indexes for dashboard aggregates", _migration_4_dashboard_indexes),
+    (5, "cache, metrics, ingestion and resume tables", _migration_5_auxiliary_stores),
+    (6, "ingestion job parse progress", _migration_6_ingestion_progress),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+# Created only when the SQLite build supports them (the FTS5 index and its shadow tables)
+OPTIONAL_TABLE_PREFIXES = ("processed_docs_fts",)
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate_database(conn):
+    """
+    Apply every migration newer than the database's user_version, each in its own
+    transaction together with the version bump. BEGIN IMMEDIATE serializes
+    concurrent starters (app and ingestion worker), which re-check the version
+    once they hold the write lock.
+
+    Raises RuntimeError if a migration is pending while conn has a transaction open,
+    rather than committing the caller's work along with it.
+    """
+    current = schema_version(conn)
+    if current > SCHEMA_VERSION:
+        raise SchemaError(f"Database schema version {current} is newer than this app supports ({SCHEMA_VERSION}).")
+    if current < SCHEMA_VERSION and conn.in_transaction:
+        raise RuntimeError("Cannot migrate the database schema inside an open transaction; commit or roll back first.")
+    for version, description, apply in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(conn) < version:
+                apply(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+@functools.lru_cache(maxsize=1)
+def _expected_schema():
+    """{table: {columns}} produced by running every migration on an empty database."""
+    reference = sqlite3.connect(":memory:")
+    try:
+        migrate_database(reference)
+        return {
+            table: columns for table, columns in _table_columns(reference).items()
+            if not table.startswith(OPTIONAL_TABLE_PREFIXES)
+        }
+    finally:
+        reference.close()
+
+
+def _table_columns(conn):
+    tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    return {
+        table: {row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+        for table in tables
+    }
+
 
-    conn.commit()
-    return conn, cursor
+def check_schema(conn):
+    """
+    Raise SchemaError unless the database is at SCHEMA_VERSION and has every table
+    and column the migrations define, other than the optional full-text index.
+    Extra tables and columns are allowed.
+    """
+    version = schema_version(conn)
+    if version != SCHEMA_VERSION:
+        raise SchemaError(f"Database schema version {version} is not supported (expected {SCHEMA_VERSION}).")
+    actual = _table_columns(conn)
+    problems = []
+    for table, columns in _expected_schema().items():
+        if table not in actual:
+            problems.append(f"missing table {table}")
+        elif columns - actual[table]:
+            problems.append(f"{table} is missing {', '.join(sorted(columns - actual[table]))}")
+    if problems:
+        raise SchemaError("Unrecognized database schema: " + "; ".join(problems))
@@ -0,0 +1,122 @@
+# document_parser.py
+#
+# Kept free of Streamlit imports: this module is imported by the worker processes.
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pypdf import PdfReader
+
+from langchain_core.documents import Document
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+# PDFs longer than this are split into page ranges parsed by separate workers
+PAGES_PER_TASK = 25
+CHUNK_SIZE = 600
+CHUNK_OVERLAP = 50
+
+
+def make_text_splitter():
+    """The splitter used for every uploaded document."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+    )
+
+
+def _load_file(file_path, file_name):
+    if file_name.lower().endswith(".pdf"):
+        docs = PyPDFLoader(file_path).load()
+    elif file_name.lower().endswith(".docx"):
+        docs = Docx2txtLoader(file_path).load()
+    else:
+        raise ValueError(f"Unsupported file type: {file_name}")
+    for d in docs:
+        # Add the filename as metadata (source)
+        d.metadata["source"] = file_name
+    return docs
+
+
+def _load_pdf_pages(file_path, file_name, start, end):
+    reader = PdfReader(file_path)
+    total_pages = len(reader.pages)
+    docs = []
+    for page_number in range(start, min(end, total_pages)):
+        docs.append(Document(
+            page_content=reader.pages[page_number].extract_text() or "",
+            metadata={
+                "source": file_name,
+                "page": page_number,
+                "page_label": str(page_number + 1),
+                "total_pages": total_pages,
+            },
+        ))
+    return docs
+
+
+def _run_task(task):
+    """Worker entry point. Returns (file_path, documents, error) instead of raising."""
+    file_path, file_name, page_range = task
+    try:
+        if page_range is None:
+            return file_path, _load_file(file_path, file_name), None
+        return file_path, _load_pdf_pages(file_path, file_name, *page_range), None
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+
+def _pdf_page_count(file_path):
+    try:
+        return len(PdfReader(file_path).pages)
+    except Exception:
+        # Let the worker report the real error when it tries to load the file
+        return 0
+
+
+def plan_tasks(files):
+    """
+    Turn (file_path, file_name) pairs into parsing tasks. Large PDFs become one task
+    per PAGES_PER_TASK pages; everything else is parsed whole.
+    """
+    tasks = []
+    for file_path, file_name in files:
+        page_count = _pdf_page_count(file_path) if file_name.lower().endswith(".pdf") else 0
+        if page_count > PAGES_PER_TASK:
+            for start in range(0, page_count, PAGES_PER_TASK):
+                tasks.append((file_path, file_name, (start, start + PAGES_PER_TASK)))
+        else:
+            tasks.append((file_path, file_name, None))
+    return tasks
+
+
+def parse_files(files, max_workers=None):
+    """
+    Parse files concurrently in a process pool.
+
+    Yields (file_path, documents, error, completed_tasks, total_tasks, file_done) as
+    each task finishes, so callers can split and store documents while other files are
+    still being parsed. Results are keyed by path, since several uploads may share a
+    file name; file_done is True for the last part of a file. A file that fails to
+    parse yields its error and does not stop the rest of the batch. Pages of a split
+    PDF may arrive out of order.
+    """
+    tasks = plan_tasks(files)
+    if not tasks:
+        return
+    max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+    parts_left = {}
+    for file_path, _, _ in tasks:
+        parts_left[file_path] = parts_left.get(file_path, 0) + 1
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_run_task, task): task for task in tasks}
+        for completed, future in enumerate(as_completed(futures), start=1):
+            try:
+                file_path, docs, error = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. BrokenProcessPool)
+                file_path, docs, error = futures[future][0], [], f"{type(e).__name__}: {e}"
+            parts_left[file_path] -= 1
+            yield file_path, docs, error, completed, len(tasks), parts_left[file_path] == 0
@@ -0,0 +1,137 @@
+# embedding_cache.py
+
+import hashlib
+import threading
+from array import array
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from db_utils import get_connection, migrate_database
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embedding model with a persistent cache of chunk vectors.
+
+    Vectors are stored as float32 BLOBs in the embedding_cache table, keyed by
+    (model name, SHA-256 of the chunk text), so re-uploading a document only embeds
+    chunks that have never been seen before. The least recently used entries are
+    evicted once the table grows past max_entries. Queries are not cached.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, db_path="database.db", max_entries=100_000):
+        self.base = base
+        self.model_name = model_name
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Ensure the embedding_cache table exists (it is defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "embedding_cache"))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+        cached = {}
+        with get_connection(self.db_path, "embedding_cache") as conn:
+            cursor = conn.cursor()
+            unique_hashes = list(set(hashes))
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT content_hash, vector FROM embedding_cache WHERE model_name = ? AND content_hash IN ({placeholders})",
+                    [self.model_name] + batch,
+                )
+                for chunk_hash, blob in cursor.fetchall():
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    cached[chunk_hash] = vector.tolist()
+            if cached:
+                cursor.executemany(
+                    "UPDATE embedding_cache SET last_used = ? WHERE model_name = ? AND content_hash = ?",
+                    [(timestamp, self.model_name, chunk_hash) for chunk_hash in cached]
+                )
+            conn.commit()
+
+        # Embed each unseen text once, even if it appears several times in the batch
+        missing = {}
+        for text, chunk_hash in zip(texts, hashes):
+            if chunk_hash not in cached and chunk_hash not in missing:
+                missing[chunk_hash] = text
+
+        with self._lock:
+            self.hits += len(texts) - sum(1 for h in hashes if h in missing)
+            self.misses += len(missing)
+
+        if missing:
+            vectors = self.base.embed_documents(list(missing.values()))
+            rows = []
+            for chunk_hash, vector in zip(missing, vectors):
+                cached[chunk_hash] = list(vector)
+                rows.append((self.model_name, chunk_hash, array("f", vector).tobytes(), timestamp))
+            with get_connection(self.db_path, "embedding_cache") as conn:
+                cursor = conn.cursor()
+                cursor.executemany('''
+                    INSERT OR REPLACE INTO embedding_cache (model_name, content_hash, vector, last_used)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+                self._evict(cursor)
+                conn.commit()
+
+        return [cached[chunk_hash] for chunk_hash in hashes]
+
+    def cached_vectors(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Cached vectors of texts (None where a text is not cached), without embedding
+        anything or updating last_used: a read-only lookup for the answer path.
+        """
+        hashes = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+        unique_hashes = list(set(hashes))
+        cached = {}
+        conn = get_connection(self.db_path, "embedding_cache")
+        for start in range(0, len(unique_hashes), 500):
+            batch = unique_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT content_hash, vector FROM embedding_cache WHERE model_name = ? AND content_hash IN ({placeholders})",
+                [self.model_name] + batch,
+            ).fetchall()
+            for chunk_hash, blob in rows:
+                vector = array("f")
+                vector.frombytes(blob)
+                cached[chunk_hash] = vector.tolist()
+        return [cached.get(chunk_hash) for chunk_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    def _evict(self, cursor):
+        """Drop the least recently used entries once the cache is over max_entries."""
+        cursor.execute("SELECT COUNT(*) FROM embedding_cache")
+        excess = cursor.fetchone()[0] - self.max_entries
+        if excess > 0:
+            cursor.execute('''
+                DELETE FROM embedding_cache WHERE rowid IN (
+                    SELECT rowid FROM embedding_cache ORDER BY last_used LIMIT ?
+                )
+            ''', (excess,))
+            with self._lock:
+                self.evictions += excess
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
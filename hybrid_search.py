@@ -0,0 +1,76 @@
+# hybrid_search.py
+#
+# Lexical (SQLite FTS5 / BM25) search over processed_docs and reciprocal rank fusion
+# with the vector results. Literal queries such as "SOP section 4.2" or "VLOOKUP"
+# match exactly on the lexical side even when embedding similarity misses them.
+
+import re
+import sqlite3
+from typing import Dict, List
+
+from langchain_core.documents import Document
+
+# Standard RRF damping constant; higher values flatten the contribution of top ranks
+RRF_K = 60
+
+
+def fts_query(text: str) -> str:
+    """
+    Turn free text into a safe FTS5 MATCH expression: every whitespace-separated term
+    becomes a quoted phrase (so "4.2" or "employee_records" match as written), OR-ed
+    together and ranked by BM25.
+    """
+    terms = []
+    for term in text.split():
+        term = term.strip(".,;:!?()[]{}'\"")
+        if re.search(r"\w", term):
+            terms.append('"' + term.replace('"', '""') + '"')
+    return " OR ".join(terms)
+
+
+def lexical_search(conn, query: str, business_roles: List[str], k: int = 5) -> List[Document]:
+    """Top-k chunks by BM25 among the given business roles. Empty if FTS5 is unavailable."""
+    match = fts_query(query)
+    if not match or not business_roles:
+        return []
+    placeholders = ",".join("?" * len(business_roles))
+    try:
+        rows = conn.execute(f'''
+            SELECT d.id, d.page_content, d.business_role, d.source, d.page, d.chunk_index
+            FROM processed_docs_fts
+            JOIN processed_docs d ON d.id = processed_docs_fts.rowid
+            WHERE processed_docs_fts MATCH ? AND d.business_role IN ({placeholders})
+            ORDER BY bm25(processed_docs_fts)
+            LIMIT ?
+        ''', [match] + list(business_roles) + [k]).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [
+        Document(
+            page_content=page_content,
+            metadata={
+                "chunk_id": row_id,
+                "business_role": business_role,
+                "source": source,
+                "page": page,
+                "chunk_index": chunk_index,
+            },
+        )
+        for row_id, page_content, business_role, source, page, chunk_index in rows
+    ]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = 5) -> List[Document]:
+    """
+    Merge ranked result lists by sum of 1 / (RRF_K + rank). Chunks are identified by
+    their processed_docs id, so a chunk found by both retrievers is counted once.
+    """
+    scores: Dict = {}
+    docs: Dict = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc.metadata.get("chunk_id", doc.page_content)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            docs.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:k]]
@@ -0,0 +1,193 @@
+# index_backends.py
+#
+# FAISS index types for the document shards. "flat" is the exact float32 index
+# LangChain builds by default; "sq8" and "ivfpq" trade a little recall for 4x and
+# ~50x smaller vectors. Set FAISS_INDEX_BACKEND to choose one; it applies whenever a
+# shard is (re)built. A shard built with another backend, or one that has outgrown
+# its IVF cells or the flat fallback, is rebuilt on its next upload, or right away with
+#
+#     python vector_store.py --rebuild [--role ROLE]
+#
+# Readers load shards memory-mapped and read-only unless FAISS_INDEX_MMAP=0, so worker
+# processes share the page cache instead of each holding a private copy. FAISS can
+# only map the inverted lists of IVF indexes, so mapping applies to "ivfpq" shards;
+# "flat" and "sq8" shards are always read into memory, whatever the setting.
+
+import os
+import math
+import pickle
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+INDEX_BACKEND = os.environ.get("FAISS_INDEX_BACKEND", "flat")
+INDEX_MMAP = os.environ.get("FAISS_INDEX_MMAP", "1") == "1"
+BACKENDS = ["flat", "sq8", "ivfpq"]
+
+# IVF-PQ: 768-dim vectors split into 48 sub-vectors of 8 bits each (48 bytes per vector)
+PQ_SUBQUANTIZERS = 48
+PQ_BITS = 8
+IVF_NPROBE = 16
+# FAISS recommends ~39 training points per centroid; PQ needs 2^PQ_BITS centroids too
+TRAINING_POINTS_PER_CENTROID = 39
+
+# Trained parameters are kept outside the shard directories, which are swapped on every save
+TRAINED_DIR = "_trained"
+
+
+def ivf_nlist(num_vectors: int) -> int:
+    """
+    Number of IVF cells: ~4*sqrt(n) rounded to a power of two, within [16, 4096].
+    Rounding keeps trained parameters reusable until the shard has roughly quadrupled.
+    """
+    target = 4 * math.sqrt(max(num_vectors, 1))
+    return int(min(4096, max(16, 2 ** round(math.log2(target)))))
+
+
+def min_training_vectors(backend: str, num_vectors: int) -> int:
+    if backend == "ivfpq":
+        return TRAINING_POINTS_PER_CENTROID * max(ivf_nlist(num_vectors), 2 ** PQ_BITS)
+    if backend == "sq8":
+        return 1
+    return 0
+
+
+def create_index(backend: str, dim: int, num_vectors: int):
+    """An empty (untrained) FAISS index of the given backend."""
+    if backend == "flat":
+        return faiss.IndexFlatL2(dim)
+    if backend == "sq8":
+        return faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit)
+    if backend == "ivfpq":
+        quantizer = faiss.IndexFlatL2(dim)
+        return faiss.IndexIVFPQ(quantizer, dim, ivf_nlist(num_vectors), PQ_SUBQUANTIZERS, PQ_BITS)
+    raise ValueError(f"Unknown FAISS index backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+def _trained_path(index_root, shard_name, backend, num_vectors):
+    # IVF parameters are keyed on the cell count, so a shard that has outgrown its
+    # centroids is retrained instead of reusing them forever
+    if backend == "ivfpq":
+        return os.path.join(index_root, TRAINED_DIR, f"{shard_name}.{backend}.nlist{ivf_nlist(num_vectors)}.faiss")
+    return os.path.join(index_root, TRAINED_DIR, f"{shard_name}.{backend}.faiss")
+
+
+def _remove_stale_trained(trained_path, shard_name, backend):
+    trained_dir = os.path.dirname(trained_path)
+    prefix = f"{shard_name}.{backend}."
+    for name in os.listdir(trained_dir):
+        path = os.path.join(trained_dir, name)
+        if name.startswith(prefix) and name.endswith(".faiss") and path != trained_path:
+            os.remove(path)
+
+
+def build_index(vectors, backend=INDEX_BACKEND, index_root=None, shard_name=None):
+    """
+    Build a populated FAISS index from an (n, dim) float32 array.
+
+    Trained parameters are reused from index_root/_trained/ when present for the same
+    shard, backend, dimension and (for ivfpq) IVF cell count, and written there after
+    training, replacing the shard's parameters for other cell counts. A shard too small
+    to train the requested backend falls back to flat. Returns (index, backend_used).
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    num_vectors, dim = vectors.shape
+    if num_vectors < min_training_vectors(backend, num_vectors):
+        backend = "flat"
+
+    index = None
+    trained_path = _trained_path(index_root, shard_name, backend, num_vectors) if index_root and shard_name else None
+    if trained_path and backend != "flat" and os.path.exists(trained_path):
+        cached = faiss.read_index(trained_path)
+        if cached.d == dim and cached.is_trained:
+            index = cached
+
+    if index is None:
+        index = create_index(backend, dim, num_vectors)
+        if not index.is_trained:
+            index.train(vectors)
+            if trained_path:
+                os.makedirs(os.path.dirname(trained_path), exist_ok=True)
+                faiss.write_index(index, trained_path)
+                _remove_stale_trained(trained_path, shard_name, backend)
+
+    index.add(vectors)
+    return index, backend
+
+
+def shard_needs_rebuild(index, num_vectors, backend=INDEX_BACKEND) -> bool:
+    """
+    Whether a shard that will hold num_vectors should be rebuilt: it uses a backend
+    other than the one build_index would pick now (including a flat fallback that
+    now has enough vectors to train), or its IVF cell count no longer fits its size.
+    """
+    expected = "flat" if num_vectors < min_training_vectors(backend, num_vectors) else backend
+    if index_backend_name(index) != expected:
+        return True
+    if expected == "ivfpq":
+        return faiss.extract_index_ivf(index).nlist != ivf_nlist(num_vectors)
+    return False
+
+
+def configure_for_search(index):
+    """Apply search-time parameters (IVF probe count) to a loaded index."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = IVF_NPROBE
+    except (RuntimeError, AttributeError):
+        pass  # not an IVF index
+    return index
+
+
+def vector_store_from_index(index, docs, ids, embeddings):
+    """Wrap a populated FAISS index and its documents in LangChain's FAISS store."""
+    docstore = InMemoryDocstore(dict(zip(ids, docs)))
+    return FAISS(embeddings, index, docstore, dict(enumerate(ids)))
+
+
+def read_vector_store(index_path, embeddings, mmap=False):
+    """
+    Load a shard saved with FAISS.save_local. With mmap=True the inverted lists of an
+    IVF (ivfpq) index are mapped read-only instead of copied into memory; such a store
+    can be searched but not added to. Other index types are read into memory. Check
+    is_index_mapped() for what actually happened.
+    """
+    faiss_file = os.path.join(index_path, "index.faiss")
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(faiss_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError:
+            index = None  # this index type cannot be mapped; read it normally
+    if index is None:
+        index = faiss.read_index(faiss_file)
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(embeddings, configure_for_search(index), docstore, index_to_docstore_id)
+
+
+def is_index_mapped(index) -> bool:
+    """Whether the index's vectors are served from a file mapping rather than memory."""
+    try:
+        invlists = faiss.downcast_InvertedLists(faiss.extract_index_ivf(index).invlists)
+    except (RuntimeError, AttributeError):
+        return False  # not an IVF index
+    return isinstance(invlists, faiss.OnDiskInvertedLists)
+
+
+def index_backend_name(index) -> str:
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        return "sq8"
+    return "flat"
+
+
+def index_memory_bytes(index) -> int:
+    """Approximate size of the stored vectors (codes) of an index."""
+    try:
+        return index.sa_code_size() * index.ntotal
+    except RuntimeError:
+        return index.d * 4 * index.ntotal
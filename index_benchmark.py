@@ -0,0 +1,100 @@
+# index_benchmark.py
+#
+# Recall-vs-latency report comparing the FAISS index backends against the exact flat
+# index. Uses the chunks already stored in processed_docs (embedded through the shared
+# embedding cache), or synthetic clustered vectors to simulate a larger corpus:
+#
+#     python index_benchmark.py --role "Business Analyst"
+#     python index_benchmark.py --synthetic 200000
+
+import time
+import argparse
+
+import faiss
+import numpy as np
+
+from db_utils import get_connection
+from index_backends import BACKENDS, build_index, configure_for_search, index_memory_bytes
+from vector_store import VectorStoreService
+
+
+def corpus_vectors(db_path, business_role=None):
+    conn = get_connection(db_path)
+    if business_role:
+        rows = conn.execute("SELECT page_content FROM processed_docs WHERE business_role = ?", (business_role,)).fetchall()
+    else:
+        rows = conn.execute("SELECT page_content FROM processed_docs").fetchall()
+    texts = [row[0] for row in rows]
+    if not texts:
+        raise SystemExit("No chunks found in processed_docs.")
+    # The embedding cache of the benchmarked database, not the app's default one
+    embeddings = VectorStoreService(db_path=db_path).embeddings
+    return np.asarray(embeddings.embed_documents(texts), dtype="float32")
+
+
+def synthetic_vectors(num_vectors, dim=768, clusters=256, seed=0):
+    """Gaussian clusters, which behave more like sentence embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=num_vectors)
+    return centers[labels] + 0.3 * rng.normal(size=(num_vectors, dim)).astype("float32")
+
+
+def run_benchmark(vectors, num_queries=200, k=5, seed=0):
+    """Returns one dict per backend: build time, memory, recall@k vs flat, query latency."""
+    rng = np.random.default_rng(seed)
+    query_ids = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    # Perturb the sampled chunks so queries are near, not identical to, stored vectors
+    queries = vectors[query_ids] + 0.05 * rng.normal(size=(len(query_ids), vectors.shape[1])).astype("float32")
+
+    report, ground_truth = [], None
+    for backend in BACKENDS:
+        start = time.perf_counter()
+        index, used = build_index(vectors, backend)
+        build_seconds = time.perf_counter() - start
+        configure_for_search(index)
+
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            _, ids = index.search(query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append(set(ids[0]))
+
+        if ground_truth is None:
+            ground_truth = results  # flat is exact and always runs first
+        recall = np.mean([len(r & g) / k for r, g in zip(results, ground_truth)])
+        report.append({
+            "backend": backend if used == backend else f"{backend} (fell back to {used})",
+            "build_s": build_seconds,
+            "memory_mb": index_memory_bytes(index) / 1024 ** 2,
+            f"recall@{k}": recall,
+            "mean_ms": float(np.mean(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+        })
+    return report
+
+
+def print_report(report, num_vectors):
+    print(f"{num_vectors} vectors, FAISS {faiss.__version__}")
+    columns = list(report[0])
+    print("  ".join(f"{c:>28}" if c == "backend" else f"{c:>10}" for c in columns))
+    for row in report:
+        cells = []
+        for c in columns:
+            value = row[c]
+            cells.append(f"{value:>28}" if c == "backend" else f"{value:>10.3f}")
+        print("  ".join(cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare FAISS index backends against the flat index.")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--role", help="Only use chunks for this business role")
+    parser.add_argument("--synthetic", type=int, help="Use this many synthetic vectors instead of processed_docs")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    vectors = synthetic_vectors(args.synthetic) if args.synthetic else corpus_vectors(args.db, args.role)
+    print_report(run_benchmark(vectors, args.queries, args.k), len(vectors))
@@ -0,0 +1,350 @@
+# ingestion_jobs.py
+#
+# Background ingestion of uploaded documents. The upload page saves files under
+# uploads/<job id>/ and queues a job; a separate worker process (this module, run as
+# a script) parses, indexes and generates questions for each file, checkpointing the
+# stage of every file in SQLite so a crashed or restarted worker resumes where it
+# stopped. A job's uploads and chunk checkpoints are deleted once it finishes. The upload page starts the worker on demand:
+#
+#     python ingestion_jobs.py
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import subprocess
+from datetime import datetime
+
+from langchain_core.documents import Document
+
+from db_utils import get_connection, migrate_database
+from logger import get_app_logger
+from llm_gateway import get_llm_gateway
+from document_parser import parse_files, make_text_splitter
+from question_generator import generate_questions_concurrently
+from vector_store import index_documents, get_vector_service
+
+UPLOAD_DIR = "uploads"
+WORKER_PID_FILE = "ingestion_worker.pid"
+POLL_SECONDS = 2
+# The worker exits after this long without work; the upload page restarts it when needed
+IDLE_EXIT_SECONDS = 600
+
+# Per-file stages, in order. "failed" files are skipped on resume.
+STAGE_UPLOADED = "uploaded"
+STAGE_PARSED = "parsed"
+STAGE_INDEXED = "indexed"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+
+
+def _now():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _pid_alive(pid) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IngestionQueue:
+    """SQLite-backed job table shared by the upload page and the worker."""
+
+    def __init__(self, db_path="database.db"):
+        self.db_path = db_path
+        self._initialize_db()
+
+    def _connect(self):
+        return get_connection(self.db_path, "ingestion_jobs")
+
+    def _initialize_db(self):
+        """Ensure the ingestion_jobs and ingestion_files tables exist (they are defined by the schema migrations)."""
+        migrate_database(self._connect())
+
+    def enqueue(self, files, business_role, created_by) -> int:
+        """
+        Save (file_name, file_bytes) pairs under uploads/<job id>/ and queue them as one
+        job. Each file is stored as <ingestion_files.id>_<name>, so files with the same
+        name never overwrite each other.
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO ingestion_jobs (business_role, created_by, status, created_at, updated_at)
+                VALUES (?, ?, 'saving', ?, ?)
+            ''', (business_role, created_by, _now(), _now()))
+            job_id = cursor.lastrowid
+            conn.commit()
+
+            job_dir = os.path.join(UPLOAD_DIR, str(job_id))
+            os.makedirs(job_dir, exist_ok=True)
+            paths = []
+            for file_name, data in files:
+                cursor.execute('''
+                    INSERT INTO ingestion_files (job_id, file_name, stage, updated_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (job_id, file_name, STAGE_UPLOADED, _now()))
+                file_id = cursor.lastrowid
+                file_path = os.path.join(job_dir, f"{file_id}_{os.path.basename(file_name)}")
+                with open(file_path, "wb") as f:
+                    f.write(data)
+                paths.append((file_path, file_id))
+            cursor.executemany("UPDATE ingestion_files SET file_path = ? WHERE id = ?", paths)
+            # Only visible to the worker once every file is on disk
+            cursor.execute("UPDATE ingestion_jobs SET status = 'queued', updated_at = ? WHERE id = ?", (_now(), job_id))
+            conn.commit()
+        return job_id
+
+    def jobs(self, limit=10):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute("SELECT * FROM ingestion_jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def job_files(self, job_id):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            rows = cursor.execute("SELECT * FROM ingestion_files WHERE job_id = ? ORDER BY id", (job_id,)).fetchall()
+        files = [dict(row) for row in rows]
+        for f in files:
+            f["questions"] = json.loads(f["questions"]) if f["questions"] else []
+        return files
+
+    def has_pending_jobs(self) -> bool:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM ingestion_jobs WHERE status IN ('queued', 'running') LIMIT 1"
+            ).fetchone()
+        return row is not None
+
+    def requeue_abandoned(self) -> int:
+        """Put jobs whose worker died mid-run back in the queue; their files resume from their last stage."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, worker_pid FROM ingestion_jobs WHERE status = 'running'").fetchall()
+            abandoned = [(_now(), job_id) for job_id, pid in rows if not _pid_alive(pid)]
+            conn.executemany(
+                "UPDATE ingestion_jobs SET status = 'queued', worker_pid = NULL, updated_at = ? WHERE id = ?",
+                abandoned
+            )
+            conn.commit()
+        return len(abandoned)
+
+    def claim_next_job(self, pid):
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute("BEGIN IMMEDIATE")
+            row = cursor.execute(
+                "SELECT * FROM ingestion_jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            conn.execute(
+                "UPDATE ingestion_jobs SET status = 'running', worker_pid = ?, updated_at = ? WHERE id = ?",
+                (pid, _now(), row["id"])
+            )
+            conn.commit()
+        return dict(row)
+
+    def set_file_stage(self, file_id, stage, error=None, chunks=None, questions=None):
+        with self._connect() as conn:
+            conn.execute('''
+                UPDATE ingestion_files
+                SET stage = ?, error = COALESCE(?, error), chunks = COALESCE(?, chunks),
+                    questions = COALESCE(?, questions), updated_at = ?
+                WHERE id = ?
+            ''', (stage, error, chunks, json.dumps(questions) if questions is not None else None, _now(), file_id))
+            conn.commit()
+
+    def set_parse_progress(self, job_id, parsed_parts, total_parts):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET parsed_parts = ?, total_parts = ?, updated_at = ? WHERE id = ?",
+                (parsed_parts, total_parts, _now(), job_id)
+            )
+            conn.commit()
+
+    def finish_job(self, job_id):
+        files = self.job_files(job_id)
+        status = "failed" if files and all(f["stage"] == STAGE_FAILED for f in files) else "done"
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET status = ?, worker_pid = NULL, updated_at = ? WHERE id = ?",
+                (status, _now(), job_id)
+            )
+            conn.commit()
+        self._remove_uploads(job_id)
+        return status
+
+    def fail_job(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE ingestion_jobs SET status = 'failed', error = ?, worker_pid = NULL, updated_at = ? WHERE id = ?",
+                (error, _now(), job_id)
+            )
+            conn.commit()
+        self._remove_uploads(job_id)
+
+    def _remove_uploads(self, job_id):
+        """Delete a finished job's uploaded files and chunk checkpoints; the chunks live on in processed_docs."""
+        shutil.rmtree(os.path.join(UPLOAD_DIR, str(job_id)), ignore_errors=True)
+
+
+# ----------------------- Worker -----------------------
+def _chunks_path(file_path):
+    return file_path + ".chunks.json"
+
+
+def _save_chunks(file_path, docs):
+    # Written to a temp file and renamed so a crash never leaves a truncated checkpoint
+    tmp_path = _chunks_path(file_path) + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump([{"page_content": d.page_content, "metadata": d.metadata} for d in docs], f, default=str)
+    os.replace(tmp_path, _chunks_path(file_path))
+
+
+def _load_chunks(file_path):
+    with open(_chunks_path(file_path)) as f:
+        return [Document(page_content=c["page_content"], metadata=c["metadata"]) for c in json.load(f)]
+
+
+def process_job(queue, job, client, logger):
+    """Run every unfinished file of a job through parse -> index -> questions."""
+    # Keyed by ingestion_files.id: a job may contain several files with the same name
+    files = {f["id"]: f for f in queue.job_files(job["id"])}
+
+    # Stage 1: parse all uploaded files together in the process pool. Each file is
+    # split, checkpointed and advanced as soon as its last page range arrives
+    to_parse = {f["file_path"]: f for f in files.values() if f["stage"] == STAGE_UPLOADED}
+    if to_parse:
+        parsed, errors = {}, {}
+        splitter = make_text_splitter()
+        for path, docs, error, completed, total, file_done in parse_files(
+            [(f["file_path"], f["file_name"]) for f in to_parse.values()]
+        ):
+            if error:
+                errors.setdefault(path, error)
+            else:
+                parsed.setdefault(path, []).extend(docs)
+            queue.set_parse_progress(job["id"], completed, total)
+            if not file_done:
+                continue
+            f = to_parse[path]
+            if path in errors:
+                queue.set_file_stage(f["id"], STAGE_FAILED, error=f"Parse failed: {errors[path]}")
+                f["stage"] = STAGE_FAILED
+                continue
+            pages = sorted(parsed.pop(path, []), key=lambda d: d.metadata.get("page", 0))
+            chunks = splitter.split_documents(pages)
+            _save_chunks(path, chunks)
+            queue.set_file_stage(f["id"], STAGE_PARSED, chunks=len(chunks))
+            f["stage"] = STAGE_PARSED
+
+    # Stage 2: index each file in its own transaction
+    for f in files.values():
+        if f["stage"] != STAGE_PARSED:
+            continue
+        conn = get_connection(queue.db_path)
+        try:
+            index_documents(conn.cursor(), _load_chunks(f["file_path"]), job["business_role"],
+                            get_vector_service().embeddings)
+            conn.commit()
+            queue.set_file_stage(f["id"], STAGE_INDEXED)
+            f["stage"] = STAGE_INDEXED
+        except Exception as e:
+            conn.rollback()
+            queue.set_file_stage(f["id"], STAGE_FAILED, error=f"Indexing failed: {e}")
+            f["stage"] = STAGE_FAILED
+
+    # Stage 3: generate questions for all indexed files concurrently
+    indexed = {file_id: f for file_id, f in files.items() if f["stage"] == STAGE_INDEXED}
+    document_chunks = {file_id: [d.page_content for d in _load_chunks(f["file_path"])] for file_id, f in indexed.items()}
+    for file_id, questions, errors in generate_questions_concurrently(client, document_chunks):
+        queue.set_file_stage(file_id, STAGE_DONE, error="; ".join(errors) if errors else None, questions=questions)
+
+    status = queue.finish_job(job["id"])
+    logger.log_event(
+        user_id=job["created_by"],
+        page="Upload Docs",
+        action="Processed Documents",
+        details=f"Ingestion job {job['id']} {status}: {len(files)} documents for role: {job['business_role']}"
+    )
+
+
+def _acquire_worker_lock():
+    """Hold an exclusive lock on the pid file for the worker's lifetime; None if another worker has it."""
+    handle = open(WORKER_PID_FILE, "a+")
+    try:
+        import fcntl
+
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass  # No flock on Windows; rely on the pid check in ensure_worker_running
+    except OSError:
+        handle.close()
+        return None
+    handle.seek(0)
+    handle.truncate()
+    handle.write(str(os.getpid()))
+    handle.flush()
+    return handle
+
+
+def run_worker():
+    lock = _acquire_worker_lock()
+    if lock is None:
+        return
+
+    client = get_llm_gateway()
+    logger = get_app_logger()
+    queue = IngestionQueue()
+    queue.requeue_abandoned()
+
+    idle_since = time.monotonic()
+    while time.monotonic() - idle_since < IDLE_EXIT_SECONDS:
+        job = queue.claim_next_job(os.getpid())
+        if job is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        try:
+            process_job(queue, job, client, logger)
+        except Exception as e:
+            # A crash of the process itself leaves the job 'running' and it is requeued on
+            # the next start; an error raised by the job is recorded instead of retried forever
+            queue.fail_job(job["id"], str(e))
+            print(f"Ingestion job {job['id']} failed: {e}", file=sys.stderr)
+        idle_since = time.monotonic()
+
+
+def ensure_worker_running():
+    """Start the background worker unless one is already alive."""
+    try:
+        with open(WORKER_PID_FILE) as f:
+            pid = int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        pid = 0
+    if _pid_alive(pid):
+        return pid
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__)],
+        cwd=os.getcwd(),
+        stdout=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    return process.pid
+
+
+if __name__ == "__main__":
+    run_worker()
@@ -0,0 +1,213 @@
+# intent_router.py
+#
+# Local "job" vs "general" routing for the onboarding assistant. Queries are embedded
+# with the sentence-transformer the vector store already has loaded and compared with
+# the centroid of labelled examples for each intent. Only low-confidence queries go to
+# the LLM classifier. Every decision is logged to intent_routes through the buffered
+# app logger; a small sample of confident decisions is first checked against the LLM
+# in the background to track accuracy, without delaying the answer.
+
+import time
+import random
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+import numpy as np
+
+from vector_store import get_vector_service
+from db_utils import get_connection, migrate_database
+from logger import AppLogger, get_app_logger
+
+ROUTER_MODEL = "llama3-8b-8192"
+# Minimum cosine-similarity gap between the two intents to trust the local decision
+ROUTER_MIN_MARGIN = 0.04
+# Share of confident decisions also sent to the LLM, to measure agreement
+ROUTER_AUDIT_RATE = 0.02
+
+INTENT_EXAMPLES = {
+    "job": [
+        "What is the company policy on remote work?",
+        "How many vacation days do I get?",
+        "How do I submit an expense report?",
+        "What health insurance benefits are offered?",
+        "What are my responsibilities as a business analyst?",
+        "Who do I report to in my team?",
+        "How do I write a SQL query to join two tables?",
+        "Can you explain how to use pandas groupby in Python?",
+        "What is the code of conduct for handling client data?",
+        "How does the performance review process work?",
+        "What tools does the data science team use?",
+        "How do I request access to the reporting database?",
+        "What does section 4.2 of the onboarding SOP say?",
+        "How should I escalate a conflict with a stakeholder?",
+        "What training do I need to complete in my first month?",
+        "How do I use VLOOKUP in Excel?",
+        "What are the working hours and overtime rules?",
+        "Explain the steps of our requirements gathering process.",
+    ],
+    "general": [
+        "Hi",
+        "Hello there!",
+        "Good morning, how are you?",
+        "Thanks a lot!",
+        "Thank you, that was helpful.",
+        "Who are you?",
+        "What can you do?",
+        "Tell me a joke.",
+        "What's the weather like today?",
+        "How was your weekend?",
+        "Nice to meet you.",
+        "Goodbye, see you tomorrow.",
+        "I'm feeling a bit nervous about starting.",
+        "Ok great",
+        "What is your name?",
+        "Can you recommend a good movie?",
+    ],
+}
+
+_auditor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="intent-audit")
+
+CLASSIFIER_PROMPT = (
+    "You are a classifier for an HR onboarding tool. "
+    "Categorize the user input into one of these two categories:\n"
+    "- 'job': For queries about company policies, benefits, work responsibilities, "
+    "or technical skills (e.g., SQL, Python).\n"
+    "- 'general': For greetings, small talk, or other non-job related queries.\n"
+    "Respond with only one word: 'job' or 'general'."
+)
+
+
+def classify_with_llm(client, user_query: str) -> str:
+    answer = client.complete(
+        ROUTER_MODEL,
+        [
+            {"role": "system", "content": CLASSIFIER_PROMPT},
+            {"role": "user", "content": f"User input: {user_query}\n\nClassify the input:"},
+        ],
+        max_tokens=5,
+        deadline=10,
+        purpose="intent_router",
+    ).lower()
+    return "general" if "general" in answer else "job"
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype="float32")
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+class IntentRouter:
+    def __init__(self, db_path="database.db", logger: AppLogger = None):
+        self.db_path = db_path
+        self.logger = logger if logger is not None else AppLogger(db_path)
+        self._labels = None
+        self._centroids = None
+        self._lock = threading.Lock()
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Ensure the intent_routes table exists (it is defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "intent_router"))
+
+    def _fit(self):
+        """Embed the labelled examples once (they are served from the embedding cache afterwards)."""
+        if self._centroids is None:
+            with self._lock:
+                if self._centroids is None:
+                    embeddings = get_vector_service().embeddings
+                    labels = list(INTENT_EXAMPLES)
+                    centroids = [
+                        _normalize(embeddings.embed_documents(INTENT_EXAMPLES[label])).mean(axis=0)
+                        for label in labels
+                    ]
+                    self._labels = labels
+                    self._centroids = _normalize(centroids)
+
+    def route(self, client, query: str, query_vector=None):
+        """
+        Return (intent, query_vector). query_vector is the query embedding, so the
+        caller can reuse it for retrieval instead of embedding the query again.
+        """
+        self._fit()
+        if query_vector is None:
+            query_vector = get_vector_service().embeddings.embed_query(query)
+        start = time.perf_counter()
+        scores = self._centroids @ _normalize(query_vector)
+        order = np.argsort(scores)[::-1]
+        local_intent = self._labels[order[0]]
+        margin = float(scores[order[0]] - scores[order[1]])
+        route_ms = (time.perf_counter() - start) * 1000
+
+        intent, method, llm_intent = local_intent, "local", None
+        if margin < ROUTER_MIN_MARGIN:
+            method = "llm_fallback"
+            try:
+                llm_intent = classify_with_llm(client, query)
+            except Exception:
+                llm_intent = None  # keep the local decision if the classifier call fails
+            if llm_intent:
+                intent = llm_intent
+        elif random.random() < ROUTER_AUDIT_RATE:
+            method = "local_audited"
+
+        decision = (query, intent, method, margin, local_intent, llm_intent, route_ms)
+        if method == "local_audited":
+            # Logged by the audit once the LLM's label is known
+            _auditor.submit(self._audit, client, decision)
+        else:
+            try:
+                self.logger.log_route(*decision)
+            except sqlite3.Error:
+                pass  # routing must not fail because the log write did
+        return intent, query_vector
+
+    def _audit(self, client, decision):
+        """Log an audited local decision with the LLM's label (runs on the audit executor)."""
+        query, intent, method, margin, local_intent, _, route_ms = decision
+        try:
+            llm_intent = classify_with_llm(client, query)
+        except Exception:
+            llm_intent = None  # an audit that fails is simply not counted
+        try:
+            self.logger.log_route(query, intent, method, margin, local_intent, llm_intent, route_ms)
+        except sqlite3.Error:
+            pass
+
+    def stats(self) -> Dict:
+        """
+        Share of queries routed locally and local accuracy, measured as agreement with
+        the LLM on the audited sample of confident local decisions. Low-confidence
+        fallbacks are excluded: they are the queries the router already declined to decide.
+        """
+        with get_connection(self.db_path, "intent_router") as conn:
+            total, local, checked, agreed, mean_ms = conn.execute('''
+                SELECT COUNT(*),
+                       SUM(method != 'llm_fallback'),
+                       SUM(method = 'local_audited' AND llm_intent IS NOT NULL),
+                       SUM(method = 'local_audited' AND llm_intent = local_intent),
+                       AVG(route_ms)
+                FROM intent_routes
+            ''').fetchone()
+        return {
+            "queries": total,
+            "local_rate": (local or 0) / total if total else None,
+            "llm_checked": checked or 0,
+            "local_accuracy": agreed / checked if checked else None,
+            "mean_route_ms": mean_ms,
+        }
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_intent_router() -> IntentRouter:
+    """Process-wide IntentRouter singleton, so the centroids are computed once."""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = IntentRouter(logger=get_app_logger())
+    return _router
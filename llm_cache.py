@@ -0,0 +1,102 @@
+# llm_cache.py
+
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional
+from db_utils import get_connection, migrate_database
+
+MAX_CACHED_RESPONSES = 5000
+
+
+def request_key(model: str, messages: List[Dict], temperature=None, max_tokens=None, **options) -> str:
+    """SHA-256 of the request fields that determine the response."""
+    payload = json.dumps(
+        dict(options, model=model, messages=messages, temperature=temperature, max_tokens=max_tokens),
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Persistent cache of chat completion responses, keyed by request_key().
+
+    Call sites opt in per call (LLMGateway.chat(..., cache=True)), and should only do
+    so where reusing an earlier answer for an identical request is acceptable, e.g.
+    summarizing the same resume or generating questions for the same document. The
+    least recently used entries are evicted once the table exceeds max_entries.
+    """
+
+    def __init__(self, db_path="database.db", max_entries=MAX_CACHED_RESPONSES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Ensure the llm_response_cache table exists (it is defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "llm_cache"))
+
+    def get(self, key: str) -> Optional[Dict]:
+        with get_connection(self.db_path, "llm_cache") as conn:
+            row = conn.execute(
+                "SELECT response, prompt_tokens, completion_tokens FROM llm_response_cache WHERE request_key = ?",
+                (key,),
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE llm_response_cache SET last_used = ?, hits = hits + 1 WHERE request_key = ?",
+                    (time.time(), key),
+                )
+                conn.commit()
+        with self._lock:
+            if row:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if row is None:
+            return None
+        return {"text": row[0], "prompt_tokens": row[1], "completion_tokens": row[2]}
+
+    def put(self, key: str, model: str, text: str, prompt_tokens=None, completion_tokens=None):
+        now = time.time()
+        with get_connection(self.db_path, "llm_cache") as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO llm_response_cache
+                    (request_key, model, response, prompt_tokens, completion_tokens, created_at, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (key, model, text, prompt_tokens, completion_tokens, now, now))
+            cursor.execute("SELECT COUNT(*) FROM llm_response_cache")
+            excess = cursor.fetchone()[0] - self.max_entries
+            if excess > 0:
+                cursor.execute('''
+                    DELETE FROM llm_response_cache WHERE request_key IN (
+                        SELECT request_key FROM llm_response_cache ORDER BY last_used LIMIT ?
+                    )
+                ''', (excess,))
+                with self._lock:
+                    self.evictions += excess
+            conn.commit()
+
+    def stats(self) -> Dict:
+        with get_connection(self.db_path, "llm_cache") as conn:
+            entries, saved_tokens = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits * (COALESCE(prompt_tokens, 0) + COALESCE(completion_tokens, 0))), 0) "
+                "FROM llm_response_cache"
+            ).fetchone()
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "tokens_saved": saved_tokens,
+        }
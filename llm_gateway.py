@@ -0,0 +1,385 @@
+# llm_gateway.py
+#
+# Single entry point for every Groq chat completion made by the app and the ingestion
+# worker. One pooled HTTP client is shared by all callers; each model has its own
+# concurrency limit; transient failures are retried with exponential backoff that
+# honours the API's rate-limit headers, within a per-call deadline. Every call's
+# latency and token usage is recorded in the llm_calls table. Calls made with
+# cache=True are answered from the persistent response cache when repeated.
+
+import os
+import re
+import time
+import random
+import sqlite3
+import asyncio
+import threading
+import weakref
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+import groq
+from groq import Groq, AsyncGroq
+
+from llm_cache import LLMResponseCache, request_key
+from db_utils import get_connection, migrate_database
+
+# Concurrent in-flight requests allowed per model (process-wide)
+MODEL_CONCURRENCY = {
+    "llama3-8b-8192": 8,
+    "llama3-70b-8192": 4,
+}
+DEFAULT_CONCURRENCY = 4
+MAX_CONNECTIONS = 20
+# Per-attempt timeout and default overall deadline (including retries), in seconds
+REQUEST_TIMEOUT = 60
+DEFAULT_DEADLINE = 120
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 30.0
+# How often an async caller re-checks for a free concurrency slot, in seconds
+ASYNC_SLOT_POLL = 0.02
+
+RETRYABLE_ERRORS = (
+    groq.RateLimitError,
+    groq.InternalServerError,
+    groq.APIConnectionError,  # includes APITimeoutError
+)
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """The call (including retries) did not finish before its deadline."""
+
+
+class LLMResult:
+    def __init__(self, text, model, latency_seconds, attempts, prompt_tokens=None, completion_tokens=None, cached=False):
+        self.text = text
+        self.model = model
+        self.latency_seconds = latency_seconds
+        self.attempts = attempts
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.cached = cached
+
+    @property
+    def total_tokens(self):
+        if self.prompt_tokens is None or self.completion_tokens is None:
+            return None
+        return self.prompt_tokens + self.completion_tokens
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """Seconds from a retry-after value ("7", "1.5") or a reset value ("1m30.5s", "250ms")."""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    scale = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def _rate_limit_hint(headers) -> Optional[float]:
+    """
+    Seconds until the exhausted rate limit resets. Only the window whose
+    x-ratelimit-remaining-* is 0 counts: on Groq the requests window is daily, so its
+    reset says nothing about a 429 caused by the per-minute token limit.
+    """
+    hinted = _parse_duration(headers.get("retry-after"))
+    if hinted is not None:
+        return hinted
+    for kind in ("tokens", "requests"):
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0":
+            hinted = _parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+            if hinted is not None:
+                return hinted
+    return None
+
+
+def retry_delay(error, attempt: int) -> float:
+    """
+    Backoff before the next attempt: for a rate-limit error, the server's hint if it
+    sent one; otherwise (and for server or connection errors) exponential with jitter.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(error, groq.RateLimitError) and response is not None:
+        hinted = _rate_limit_hint(response.headers)
+        if hinted is not None:
+            return min(hinted, BACKOFF_MAX)
+    return min(BACKOFF_BASE * 2 ** attempt, BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+class LLMGateway:
+    def __init__(self, api_key=None, db_path="database.db"):
+        self.api_key = api_key or os.environ["GROQ_API_KEY"]
+        self.db_path = db_path
+        limits = httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+        # The SDK's own retries are disabled; the gateway retries with its own deadline
+        self.client = Groq(
+            api_key=self.api_key,
+            max_retries=0,
+            timeout=REQUEST_TIMEOUT,
+            http_client=httpx.Client(limits=limits, timeout=REQUEST_TIMEOUT),
+        )
+        self._limits = limits
+        self._semaphores = {}
+        self._async_clients = weakref.WeakKeyDictionary()  # event loop -> AsyncGroq
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.cache = LLMResponseCache(db_path)
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Ensure the llm_calls table exists (it is defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "llm_gateway"))
+
+    # ----------------------- Limits and metrics -----------------------
+    def _semaphore(self, model):
+        """The model's concurrency limit, shared by the sync, streaming and async APIs."""
+        with self._lock:
+            if model not in self._semaphores:
+                self._semaphores[model] = threading.BoundedSemaphore(MODEL_CONCURRENCY.get(model, DEFAULT_CONCURRENCY))
+            return self._semaphores[model]
+
+    def _async_client(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if loop not in self._async_clients:
+                self._async_clients[loop] = AsyncGroq(
+                    api_key=self.api_key,
+                    max_retries=0,
+                    timeout=REQUEST_TIMEOUT,
+                    http_client=httpx.AsyncClient(limits=self._limits, timeout=REQUEST_TIMEOUT),
+                )
+            return self._async_clients[loop]
+
+    @staticmethod
+    async def _acquire_async(semaphore):
+        # Polled rather than awaited in a thread, so waiting callers do not tie up the
+        # default executor; the caller's deadline cancels the wait
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(ASYNC_SLOT_POLL)
+
+    def record(self, model, purpose, status, attempts, latency_seconds, ttft_seconds=None,
+               prompt_tokens=None, completion_tokens=None, error=None):
+        with self._lock:
+            stats = self._stats.setdefault(model, {
+                "calls": 0, "errors": 0, "latency_seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            stats["calls"] += 1
+            stats["errors"] += status != "ok"
+            stats["latency_seconds"] += latency_seconds
+            stats["prompt_tokens"] += prompt_tokens or 0
+            stats["completion_tokens"] += completion_tokens or 0
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            with get_connection(self.db_path, "llm_gateway") as conn:
+                conn.execute('''
+                    INSERT INTO llm_calls (timestamp, model, purpose, status, attempts, latency_ms, ttft_ms,
+                                           prompt_tokens, completion_tokens, error)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    timestamp, model, purpose, status, attempts, latency_seconds * 1000,
+                    ttft_seconds * 1000 if ttft_seconds is not None else None,
+                    prompt_tokens, completion_tokens, error,
+                ))
+                conn.commit()
+        except sqlite3.Error:
+            pass  # metrics must never fail a completion
+
+    def stats(self) -> Dict:
+        """Per-model call counts, error counts, mean latency and token totals for this process."""
+        with self._lock:
+            return {
+                model: dict(s, mean_latency_seconds=s["latency_seconds"] / s["calls"] if s["calls"] else 0.0)
+                for model, s in self._stats.items()
+            }
+
+    # ----------------------- Sync API -----------------------
+    def _with_retries(self, model, purpose, deadline, send, hold=False):
+        """
+        Run send(timeout) under the model's semaphore, retrying transient errors until
+        the deadline. With hold=True the slot stays taken after success and the caller
+        must release it. Returns (result, attempts).
+        """
+        start = time.monotonic()
+        deadline_at = start + (deadline or DEFAULT_DEADLINE)
+        semaphore = self._semaphore(model)
+        attempt = 0
+        while True:
+            remaining = deadline_at - time.monotonic()
+            if remaining <= 0 or not semaphore.acquire(timeout=remaining):
+                self.record(model, purpose, "error", attempt, time.monotonic() - start, error="deadline")
+                raise LLMDeadlineExceeded(f"{model} call exceeded its {deadline or DEFAULT_DEADLINE}s deadline")
+            attempt += 1
+            try:
+                result = send(max(0.1, min(REQUEST_TIMEOUT, deadline_at - time.monotonic())))
+            except RETRYABLE_ERRORS as e:
+                semaphore.release()
+                delay = retry_delay(e, attempt - 1)
+                if attempt >= MAX_ATTEMPTS or time.monotonic() + delay >= deadline_at:
+                    self.record(model, purpose, "error", attempt, time.monotonic() - start, error=str(e))
+                    raise
+                time.sleep(delay)
+                continue
+            except Exception as e:
+                semaphore.release()
+                self.record(model, purpose, "error", attempt, time.monotonic() - start, error=str(e))
+                raise
+            if not hold:
+                semaphore.release()
+            return result, attempt
+
+    def _cached(self, key, model, start):
+        hit = self.cache.get(key)
+        if hit is None:
+            return None
+        return LLMResult(hit["text"], model, time.monotonic() - start, 0,
+                         hit["prompt_tokens"], hit["completion_tokens"], cached=True)
+
+    def chat(self, model: str, messages: List[Dict], temperature=None, max_tokens=None,
+             deadline=None, purpose=None, cache=False, cache_if=None, **kwargs) -> LLMResult:
+        """
+        One chat completion with retries. Returns an LLMResult with text, latency and
+        token usage. With cache=True an identical earlier request (same model, messages,
+        temperature, max_tokens and options) is answered from the response cache.
+        Pass cache_if(text) -> bool to store only responses that pass validation, so
+        a broken reply is not replayed to the caller's repair request.
+        """
+        options = {k: v for k, v in {"temperature": temperature, "max_tokens": max_tokens}.items() if v is not None}
+        options.update(kwargs)
+        start = time.monotonic()
+        key = request_key(model, messages, temperature, max_tokens, **kwargs) if cache else None
+        if key:
+            cached = self._cached(key, model, start)
+            if cached:
+                return cached
+        response, attempts = self._with_retries(
+            model, purpose, deadline,
+            lambda timeout: self.client.chat.completions.create(
+                model=model, messages=messages, timeout=timeout, **options
+            ),
+        )
+        latency = time.monotonic() - start
+        usage = getattr(response, "usage", None)
+        result = LLMResult(
+            response.choices[0].message.content or "", model, latency, attempts,
+            getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None),
+        )
+        self.record(model, purpose, "ok", attempts, latency,
+                    prompt_tokens=result.prompt_tokens, completion_tokens=result.completion_tokens)
+        if key and (cache_if is None or cache_if(result.text)):
+            self.cache.put(key, model, result.text, result.prompt_tokens, result.completion_tokens)
+        return result
+
+    def complete(self, model: str, messages: List[Dict], **kwargs) -> str:
+        """Like chat(), returning just the stripped response text."""
+        return self.chat(model, messages, **kwargs).text.strip()
+
+    def open_stream(self, model, messages, deadline=None, purpose=None, **options):
+        """
+        Start a streamed completion, retrying until the stream opens. Returns
+        (stream, release): the model's concurrency slot is held while the caller
+        iterates the stream, and release() must be called once it is done.
+        """
+        stream, _ = self._with_retries(
+            model, purpose, deadline,
+            lambda timeout: self.client.chat.completions.create(
+                model=model, messages=messages, stream=True, timeout=timeout, **options
+            ),
+            hold=True,
+        )
+        released = threading.Event()
+        semaphore = self._semaphore(model)
+
+        def release():
+            if not released.is_set():
+                released.set()
+                semaphore.release()
+        return stream, release
+
+    # ----------------------- Async API -----------------------
+    async def achat(self, model: str, messages: List[Dict], temperature=None, max_tokens=None,
+                    deadline=None, purpose=None, cache=False, cache_if=None, **kwargs) -> LLMResult:
+        """asyncio counterpart of chat()."""
+        options = {k: v for k, v in {"temperature": temperature, "max_tokens": max_tokens}.items() if v is not None}
+        options.update(kwargs)
+        client = self._async_client()
+        semaphore = self._semaphore(model)
+        start = time.monotonic()
+        key = request_key(model, messages, temperature, max_tokens, **kwargs) if cache else None
+        if key:
+            cached = await asyncio.to_thread(self._cached, key, model, start)
+            if cached:
+                return cached
+        deadline_at = start + (deadline or DEFAULT_DEADLINE)
+        attempt = 0
+
+        async def send():
+            # The same per-model slots as the sync API, so the limit holds process-wide
+            await self._acquire_async(semaphore)
+            try:
+                return await client.chat.completions.create(
+                    model=model, messages=messages,
+                    timeout=max(0.1, min(REQUEST_TIMEOUT, deadline_at - time.monotonic())), **options
+                )
+            finally:
+                semaphore.release()
+
+        while True:
+            remaining = deadline_at - time.monotonic()
+            attempt += 1
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                response = await asyncio.wait_for(send(), timeout=remaining)
+                break
+            except RETRYABLE_ERRORS as e:
+                delay = retry_delay(e, attempt - 1)
+                if attempt >= MAX_ATTEMPTS or time.monotonic() + delay >= deadline_at:
+                    self.record(model, purpose, "error", attempt, time.monotonic() - start, error=str(e))
+                    raise
+                await asyncio.sleep(delay)
+            except asyncio.TimeoutError:
+                self.record(model, purpose, "error", attempt, time.monotonic() - start, error="deadline")
+                raise LLMDeadlineExceeded(f"{model} call exceeded its {deadline or DEFAULT_DEADLINE}s deadline")
+            except Exception as e:
+                self.record(model, purpose, "error", attempt, time.monotonic() - start, error=str(e))
+                raise
+
+        latency = time.monotonic() - start
+        usage = getattr(response, "usage", None)
+        result = LLMResult(
+            response.choices[0].message.content or "", model, latency, attempt,
+            getattr(usage, "prompt_tokens", None), getattr(usage, "completion_tokens", None),
+        )
+        # The SQLite write is moved off the event loop
+        await asyncio.to_thread(
+            self.record, model, purpose, "ok", attempt, latency, None,
+            result.prompt_tokens, result.completion_tokens,
+        )
+        if key and (cache_if is None or cache_if(result.text)):
+            await asyncio.to_thread(self.cache.put, key, model, result.text, result.prompt_tokens, result.completion_tokens)
+        return result
+
+    async def acomplete(self, model: str, messages: List[Dict], **kwargs) -> str:
+        return (await self.achat(model, messages, **kwargs)).text.strip()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    """Process-wide LLMGateway singleton."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
@@ -0,0 +1,79 @@
+# llm_streaming.py
+#
+# Streamed chat completions through the LLM gateway. Text is yielded as the Groq API
+# produces it, so pages can render the reply token by token; the full text and
+# time-to-first-token are kept on the object for logging and conversation history
+# once the stream is consumed.
+
+import time
+
+from text_utils import estimate_tokens
+
+
+class StreamedCompletion:
+    """
+    Iterate to receive text deltas. After iteration, text holds the full response,
+    ttft_seconds the time from request to the first token and total_seconds the time
+    to the last one. on_complete(text), if given, is called once a stream finishes
+    without error.
+    """
+
+    def __init__(self, gateway, messages, model, temperature=0.7, max_tokens=1000, on_complete=None, purpose=None):
+        self.gateway = gateway
+        self.messages = messages
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.on_complete = on_complete
+        self.purpose = purpose
+        self.text = ""
+        self.ttft_seconds = None
+        self.total_seconds = None
+
+    def __iter__(self):
+        start = time.perf_counter()
+        stream, release = self.gateway.open_stream(
+            self.model,
+            self.messages,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens,
+            purpose=self.purpose,
+        )
+        usage = None
+        try:
+            for chunk in stream:
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq is not None and getattr(x_groq, "usage", None):
+                    usage = x_groq.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if self.ttft_seconds is None:
+                    self.ttft_seconds = time.perf_counter() - start
+                # Accumulated as it arrives so a stream cut off midway still leaves the partial text
+                self.text += delta
+                yield delta
+        except Exception as e:
+            self.gateway.record(self.model, self.purpose, "error", 1, time.perf_counter() - start,
+                                ttft_seconds=self.ttft_seconds, error=str(e))
+            raise
+        finally:
+            release()
+        self.total_seconds = time.perf_counter() - start
+        self.text = self.text.strip()
+        self.gateway.record(
+            self.model, self.purpose, "ok", 1, self.total_seconds, ttft_seconds=self.ttft_seconds,
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+        )
+        if self.on_complete:
+            self.on_complete(self.text)
+
+    def latency_details(self) -> str:
+        """One-line summary for the event log."""
+        ttft = f"{self.ttft_seconds * 1000:.0f}ms" if self.ttft_seconds is not None else "n/a"
+        total = f"{self.total_seconds * 1000:.0f}ms" if self.total_seconds is not None else "n/a"
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in self.messages)
+        return f"model={self.model}; ttft={ttft}; total={total}; prompt_tokens~{prompt_tokens}; chars={len(self.text)}"
@@ -1,14 +1,10 @@
 import streamlit as st
-import sqlite3
-import os
-import tempfile
 import json
-import time
 
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_community.vectorstores import FAISS
+from db_utils import get_connection
+from ingestion_jobs import IngestionQueue, ensure_worker_running, STAGE_DONE, STAGE_FAILED
+from vector_store import get_vector_service, COMPANY_WIDE_ROLE
+from intent_router import get_intent_router
 
 
 def run_upload_data(conn, cursor, client, logger):
@@ -18,136 +14,31 @@ def run_upload_data(conn, cursor, client, logger):
     # Business role selection widget
     business_role = st.selectbox(
         "Select the business role for these documents:",
-        ["Business Analyst", "Data Scientist", "Manager", "Other"]
+        ["Business Analyst", "Data Scientist", "Manager", "Other", COMPANY_WIDE_ROLE]
     )
 
     # File uploader widget (accepts multiple files)
     uploaded_files = st.file_uploader("Choose files", type=["pdf", "docx"], accept_multiple_files=True)
 
-    def generate_questions(doc_text: str) -> list:
-        """
-        Generate 10 multiple-choice questions based on the provided document text
-        using GROQ's llama3-8b-8192. Each question should have four options labeled A, B, C, D,
-        with the correct answer indicated. The response is expected to be in JSON format,
-        a list of objects with keys: 'question', 'options', and 'answer'.
-        """
-        system_prompt = (
-            "You are an expert in creating multiple-choice questions for training purposes. "
-            "Based on the provided text, generate 10 multiple-choice questions. "
-            "Each question must include four answer options labeled A, B, C, and D, and clearly indicate "
-            "the correct answer. Format your response strictly as a JSON list of objects, where each object has the keys: "
-            "'question', 'options', and 'answer'. Do not include any other text, explanations, or formatting outside of this JSON structure.\n"
-            "For example:\n"
-            '[{"question": "What is ...?", "options": {"A": "...", "B": "...", "C": "...", "D": "..."}, "answer": "A"}, ...]\n'
-            "Please ensure that your response is **only** in the following JSON format without any extra explanation."
-        )
-        
-        user_message = f"Document text:\n{doc_text}\n\nPlease generate the questions."
-        
-        attempts = 0
-        max_attempts = 5
-        while attempts < max_attempts:
-            try:
-                response = client.chat.completions.create(
-                    model="llama3-8b-8192",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_message}
-                    ]
-                )
-                questions_str = response.choices[0].message.content.strip()
-                questions = json.loads(questions_str)
-                return questions
-            except json.JSONDecodeError as e:
-                st.error(f"Error parsing generated questions. Attempt {attempts + 1}/{max_attempts} failed: {e}")
-            except Exception as e:
-                st.error(f"Unexpected error: {e}")
-            attempts += 1
-            time.sleep(2)
-        st.error("Failed to generate valid questions after multiple attempts.")
-        return []
-
-    # Process documents and generate questions when the button is clicked
+    # Queue the documents for the background ingestion worker when the button is clicked
     if st.button("Process Documents"):
         if uploaded_files:
-            documents = []
-            # Create a temporary directory to save uploaded files
-            with tempfile.TemporaryDirectory() as temp_dir:
-                for uploaded_file in uploaded_files:
-                    file_path = os.path.join(temp_dir, uploaded_file.name)
-                    # Save the uploaded file to disk
-                    with open(file_path, "wb") as f:
-                        f.write(uploaded_file.getbuffer())
-                    
-                    # Process file based on its extension
-                    if uploaded_file.name.lower().endswith(".pdf"):
-                        loader = PyPDFLoader(file_path)
-                        docs = loader.load()
-                        for d in docs:
-                            # Add the filename as metadata (source)
-                            d.metadata["source"] = uploaded_file.name
-                        documents.extend(docs)
-                    elif uploaded_file.name.lower().endswith(".docx"):
-                        loader = Docx2txtLoader(file_path)
-                        docs = loader.load()
-                        for d in docs:
-                            d.metadata["source"] = uploaded_file.name
-                        documents.extend(docs)
-            
+            job_id = IngestionQueue().enqueue(
+                [(uploaded_file.name, uploaded_file.getbuffer().tobytes()) for uploaded_file in uploaded_files],
+                business_role,
+                st.session_state.username
+            )
+            ensure_worker_running()
+            st.success(f"Queued {len(uploaded_files)} document(s) for processing as job #{job_id}.")
+
             # Log document upload event
             for uploaded_file in uploaded_files:
                 logger.log_event(
                     user_id=st.session_state.username,
                     page="Upload Docs",
                     action="Uploaded Document",
-                    details=f"Document: {uploaded_file.name}, Role: {business_role}"
+                    details=f"Document: {uploaded_file.name}, Role: {business_role}, Job: {job_id}"
                 )
-            
-            # Split documents into chunks and create a FAISS vector store
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=600,
-                chunk_overlap=50,
-                length_function=len,
-            )
-            processed_docs = text_splitter.split_documents(documents)
-            embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-            vector_store = FAISS.from_documents(processed_docs, embeddings)
-            vector_store.save_local("faiss_index")
-            
-            # Insert each processed document into the SQLite database
-            for doc in processed_docs:
-                cursor.execute('''
-                    INSERT INTO processed_docs (page_content, metadata, business_role)
-                    VALUES (?, ?, ?)
-                ''', (doc.page_content, str(doc.metadata), business_role))
-            
-            conn.commit()
-            st.success("Documents processed and stored successfully!")
-            
-            # Log document processing event
-            logger.log_event(
-                user_id=st.session_state.username,
-                page="Upload Docs",
-                action="Processed Documents",
-                details=f"Processed {len(uploaded_files)} documents for role: {business_role}"
-            )
-            
-            # Combine full text for each uploaded document (grouped by file/source)
-            combined_texts = {}
-            for doc in documents:
-                source = doc.metadata.get("source", "unknown")
-                if source not in combined_texts:
-                    combined_texts[source] = ""
-                combined_texts[source] += "\n" + doc.page_content
-            
-            # Generate questions for each document and store them in session state
-            all_questions = {}
-            for source, full_text in combined_texts.items():
-                st.write(f"Generating questions for document: {source}")
-                questions = generate_questions(full_text)
-                all_questions[source] = questions
-            
-            st.session_state.all_questions = all_questions
         else:
             st.warning("Please upload at least one file.")
             logger.log_event(
@@ -157,6 +48,91 @@ def run_upload_data(conn, cursor, client, logger):
                 details="User attempted to process without uploading files."
             )
 
+    # Job status is polled from the ingestion tables; the work itself runs in the worker process
+    @st.fragment(run_every=3)
+    def show_ingestion_jobs():
+        queue = IngestionQueue()
+        jobs = queue.jobs(limit=5)
+        if not jobs:
+            return
+        st.header("Processing Jobs")
+        if queue.has_pending_jobs():
+            ensure_worker_running()
+        for job in jobs:
+            files = queue.job_files(job["id"])
+            finished = sum(1 for f in files if f["stage"] in (STAGE_DONE, STAGE_FAILED))
+            with st.expander(f"Job #{job['id']} ({job['business_role']}): {job['status']}, {finished}/{len(files)} documents finished"):
+                if job["error"]:
+                    st.error(job["error"])
+                st.progress(finished / len(files) if files else 1.0)
+                if job["total_parts"] and job["parsed_parts"] < job["total_parts"]:
+                    st.caption(f"Parsing: {job['parsed_parts']}/{job['total_parts']} parts")
+                for f in files:
+                    chunks = f" ({f['chunks']} chunks)" if f["chunks"] is not None else ""
+                    st.write(f"{f['file_name']}: {f['stage']}{chunks}")
+                    if f["error"]:
+                        st.caption(f["error"])
+                if any(f["questions"] for f in files):
+                    if st.button("Review generated questions", key=f"review_job_{job['id']}"):
+                        # Files uploaded under the same name are reviewed as one document
+                        all_questions = {}
+                        for f in files:
+                            all_questions.setdefault(f["file_name"], []).extend(f["questions"])
+                        st.session_state.all_questions = {name: qs for name, qs in all_questions.items() if qs}
+                        st.session_state.questions_business_role = job["business_role"]
+                        st.rerun()
+
+    show_ingestion_jobs()
+
+    with st.expander("Vector store status"):
+        stats = get_vector_service().stats()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Indexed Chunks", f"{stats['num_vectors']} in {stats['num_shards']} shard(s)")
+        col2.metric("Index Memory (MB)", f"{stats['index_memory_mb']:.1f}")
+        col3.metric("Process Memory (MB)", f"{stats['process_rss_mb']:.0f}")
+        model_load = stats["model_load_seconds"]
+        index_load = stats["index_load_seconds"]
+        st.write(f"Model load time: {model_load:.2f}s" if model_load is not None else "Model not loaded yet")
+        st.write(f"Last index load time: {index_load:.2f}s" if index_load is not None else "Index not loaded yet")
+        st.write(f"Index loads: {stats['index_loads']}, searches served: {stats['searches']}")
+        st.write(
+            f"Index backend: {', '.join(stats['index_backends']) or 'none loaded'}"
+            f" ({stats['mapped_shards']} of {stats['num_shards']} shard(s) memory-mapped)"
+        )
+        cache = stats["embedding_cache"]
+        if cache:
+            st.write(
+                f"Embedding cache: {cache['hits']} hits, {cache['misses']} misses "
+                f"({cache['hit_rate']:.0%} hit rate), {cache['evictions']} evictions"
+            )
+        for model, calls in client.stats().items():
+            st.write(
+                f"LLM {model}: {calls['calls']} calls ({calls['errors']} failed), "
+                f"mean latency {calls['mean_latency_seconds']:.2f}s, "
+                f"{calls['prompt_tokens']} prompt / {calls['completion_tokens']} completion tokens"
+            )
+        responses = client.cache.stats()
+        st.write(
+            f"LLM response cache: {responses['hits']} hits, {responses['misses']} misses "
+            f"({responses['hit_rate']:.0%} hit rate), {responses['entries']} entries, "
+            f"~{responses['tokens_saved']} tokens saved"
+        )
+        log_stats = logger.stats()
+        if log_stats:
+            st.write(
+                f"Event log: {log_stats['written']} written in {log_stats['batches']} batches, "
+                f"{log_stats['queued']} queued, {log_stats['blocked']} producers blocked, "
+                f"{log_stats['dropped']} dropped"
+            )
+        routes = get_intent_router().stats()
+        if routes["queries"]:
+            accuracy = routes["local_accuracy"]
+            st.write(
+                f"Assistant query routing: {routes['local_rate']:.0%} of {routes['queries']} routed locally "
+                f"(mean {routes['mean_route_ms']:.2f} ms); agreement with the LLM classifier: "
+                + (f"{accuracy:.0%} over {routes['llm_checked']} audited" if accuracy is not None else "not measured yet")
+            )
+
     # Display generated questions if they exist in session state
     if "all_questions" in st.session_state:
         st.header("Generated Multiple Choice Questions")
@@ -173,23 +149,13 @@ def run_upload_data(conn, cursor, client, logger):
 
     # Button to save selected questions to the database
     if st.button("Save Selected Questions"):
-        # Re-open (or create) the database and ensure the questions table exists
-        conn = sqlite3.connect('database.db')
+        conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS questions (
-                id INTEGER PRIMARY KEY,
-                document_title TEXT,
-                business_role TEXT,
-                question TEXT,
-                options TEXT,
-                answer TEXT
-            )
-        ''')
-        conn.commit()
 
         if "all_questions" in st.session_state:
             all_questions = st.session_state.all_questions
+            # Questions reviewed from a job belong to the role that job was uploaded for
+            questions_role = st.session_state.get("questions_business_role", business_role)
             saved_count = 0
             for source, questions in all_questions.items():
                 for i, q in enumerate(questions, start=1):
@@ -199,7 +165,7 @@ def run_upload_data(conn, cursor, client, logger):
                             VALUES (?, ?, ?, ?, ?)
                         ''', (
                             source,
-                            business_role,
+                            questions_role,
                             q.get("question", ""),
                             json.dumps(q.get("options", {})),
                             q.get("answer", "")
@@ -208,6 +174,4 @@ def run_upload_data(conn, cursor, client, logger):
             conn.commit()
             st.success(f"Saved {saved_count} selected questions to the database.")
         else:
-            st.warning("No questions available to save.")
-
-        conn.close()
\ No newline at end of file
+            st.warning("No questions available to save.")
\ No newline at end of file
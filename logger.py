@@ -1,56 +1,181 @@
+import time
+import queue
+import atexit
 import sqlite3
+import threading
 from datetime import datetime
 
+from db_utils import get_connection, migrate_database
+
+# Buffered mode: rows are written in batches of up to LOG_BATCH_SIZE, at least every
+# LOG_FLUSH_SECONDS. When LOG_QUEUE_SIZE rows are waiting, callers block for up to
+# LOG_ENQUEUE_TIMEOUT seconds before the row is dropped (and counted).
+LOG_BATCH_SIZE = 200
+LOG_FLUSH_SECONDS = 1.0
+LOG_QUEUE_SIZE = 10_000
+LOG_ENQUEUE_TIMEOUT = 0.5
+
+LOG_INSERTS = {
+    "logs": "INSERT INTO logs (timestamp, user_id, page, action, details) VALUES (?, ?, ?, ?, ?)",
+    "mistakes": '''
+        INSERT INTO mistakes (user_id, question, correct_answer, user_answer, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+    ''',
+    "intent_routes": '''
+        INSERT INTO intent_routes (timestamp, query, intent, method, margin, local_intent, llm_intent, route_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''',
+}
+
+
 class AppLogger:
-    def __init__(self, db_path="database.db"):
+    def __init__(self, db_path="database.db", buffered=False):
         self.db_path = db_path
+        self.buffered = buffered
         self._initialize_db()
+        if buffered:
+            self._queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+            self._stats_lock = threading.Lock()
+            self._stats = {"enqueued": 0, "written": 0, "batches": 0, "blocked": 0, "dropped": 0, "write_errors": 0}
+            self._closed = False
+            self._writer = threading.Thread(target=self._run_writer, name="app-logger", daemon=True)
+            self._writer.start()
+            atexit.register(self.close)
 
     def _initialize_db(self):
-        """Ensure the logs and mistakes tables exist."""
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT,
-                    user_id TEXT,
-                    page TEXT,
-                    action TEXT,
-                    details TEXT
-                )
-            ''')
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS mistakes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id TEXT,
-                    question TEXT,
-                    correct_answer TEXT,
-                    user_answer TEXT,
-                    timestamp TEXT
-                )
-            ''')
-            conn.commit()
+        """Ensure the logged tables exist (they are defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "logger"))
 
     def log_event(self, user_id, page, action, details=""):
         """Insert a log entry into the database."""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO logs (timestamp, user_id, page, action, details)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (timestamp, user_id, page, action, details))
-            conn.commit()
+        self._write("logs", [(timestamp, user_id, page, action, details)])
 
     def log_mistakes(self, user_id, mistakes):
         """Log mistakes in a separate table."""
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        with sqlite3.connect(self.db_path) as conn:
+        self._write("mistakes", [
+            (user_id, mistake['question'], mistake['correct_answer'], mistake['user_answer'], timestamp)
+            for mistake in mistakes
+        ])
+
+    def log_route(self, query, intent, method, margin, local_intent, llm_intent, route_ms):
+        """Record one intent routing decision (see intent_router.py)."""
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._write("intent_routes", [(timestamp, query, intent, method, margin, local_intent, llm_intent, route_ms)])
+
+    def _write(self, table, rows):
+        if not rows:
+            return
+        if not self.buffered or self._closed:
+            self._insert_batch({table: rows})
+            return
+        for row in rows:
+            self._enqueue((table, row))
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self._stats["blocked"] += 1
+            try:
+                self._queue.put(item, timeout=LOG_ENQUEUE_TIMEOUT)
+            except queue.Full:
+                with self._stats_lock:
+                    self._stats["dropped"] += 1
+                return
+        with self._stats_lock:
+            self._stats["enqueued"] += 1
+
+    def _insert_batch(self, batch):
+        """Write {table: [rows]} in one transaction."""
+        with get_connection(self.db_path, "logger") as conn:
             cursor = conn.cursor()
-            for mistake in mistakes:
-                cursor.execute('''
-                    INSERT INTO mistakes (user_id, question, correct_answer, user_answer, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                ''', (user_id, mistake['question'], mistake['correct_answer'], mistake['user_answer'], timestamp))
+            for table, rows in batch.items():
+                cursor.executemany(LOG_INSERTS[table], rows)
             conn.commit()
+
+    # ----------------------- Background writer -----------------------
+    def _run_writer(self):
+        stopping = False
+        while not stopping:
+            batch, count, waiters = {}, 0, []
+            flush_at = time.monotonic() + LOG_FLUSH_SECONDS
+            while count < LOG_BATCH_SIZE:
+                try:
+                    item = self._queue.get(timeout=max(0.0, flush_at - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                table, row = item
+                batch.setdefault(table, []).append(row)
+                count += 1
+            if stopping:
+                # Drain whatever was queued before close()
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, tuple):
+                        batch.setdefault(item[0], []).append(item[1])
+                        count += 1
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+            if batch:
+                try:
+                    self._insert_batch(batch)
+                    with self._stats_lock:
+                        self._stats["written"] += count
+                        self._stats["batches"] += 1
+                except sqlite3.Error:
+                    with self._stats_lock:
+                        self._stats["write_errors"] += 1
+                        self._stats["dropped"] += count
+            for waiter in waiters:
+                waiter.set()
+
+    def flush(self, timeout=5.0):
+        """Block until everything logged so far has been written (buffered mode)."""
+        if not self.buffered or self._closed:
+            return
+        done = threading.Event()
+        self._queue.put(done)
+        done.wait(timeout)
+
+    def close(self):
+        """Flush remaining rows and stop the writer thread; later calls write directly."""
+        if not self.buffered or self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+
+    def stats(self):
+        """Queue depth and enqueue/write/backpressure counters (buffered mode)."""
+        if not self.buffered:
+            return {}
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        return stats
+
+
+_app_logger = None
+_app_logger_lock = threading.Lock()
+
+
+def get_app_logger() -> AppLogger:
+    """Process-wide buffered AppLogger, so Streamlit reruns share one writer thread."""
+    global _app_logger
+    if _app_logger is None:
+        with _app_logger_lock:
+            if _app_logger is None:
+                _app_logger = AppLogger(buffered=True)
+    return _app_logger
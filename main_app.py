@@ -1,9 +1,8 @@
 import streamlit as st
-from groq import Groq
 import os
-import sqlite3
 import streamlit.components.v1 as components
-from logger import AppLogger
+from logger import get_app_logger
+from llm_gateway import get_llm_gateway
 from db_utils import get_connection, initialize_database
 from ask_questions import run_ask_questions as run_chatbot_module
 from load_data import run_upload_data
@@ -18,10 +17,10 @@ from add_scenario import run_generate_scenario_module
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 os.environ["GROQ_API_KEY"] = "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"
 
-# Initialize Groq client
-client = Groq(api_key=os.environ["GROQ_API_KEY"])
+# Shared LLM gateway (pooled Groq client with retries, deadlines and per-model limits)
+client = get_llm_gateway()
 
-# Connect to the SQLite database and initialize tables
+# This thread's SQLite connection; initialize tables
 conn = get_connection()
 conn, cursor = initialize_database(conn)
 
@@ -71,14 +70,11 @@ if "page" not in st.session_state:
 
 # Function to handle user login with hardcoded users
 def handle_login(username, password, role):
-    # Connect to the database
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-    # Retrieve all user records
-    cursor.execute("SELECT username, password, system_role FROM users")
+    cursor = get_connection().cursor()
+    # Served from the UNIQUE index on username
+    cursor.execute("SELECT username, password, system_role FROM users WHERE username = ?", (username,))
     rows = cursor.fetchall()
     dummy_users = {username: {"password": password, "role": role} for username, password, role in rows}
-    conn.close()
 
     if username in dummy_users:
         if dummy_users[username]["password"] == password and dummy_users[username]["role"] == role:
@@ -144,8 +140,8 @@ def logout():
     st.success("You have been logged out successfully.")
     st.rerun()
 
-# Initialize logger
-logger = AppLogger()
+# Shared buffered logger; events are written in batches by a background thread
+logger = get_app_logger()
 
 # Main content routing
 if st.session_state.page == "login":
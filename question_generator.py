@@ -0,0 +1,230 @@
+# question_generator.py
+#
+# MCQ generation for uploaded documents. Runs in worker threads, so nothing here
+# touches Streamlit; errors are returned to the caller to display.
+
+import re
+import math
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from structured_output import MCQ_SCHEMA, generate_items, parse_items
+from text_utils import estimate_tokens
+
+QUESTION_MODEL = "llama3-8b-8192"
+MAX_CONCURRENT_REQUESTS = 4
+# Groq's tokens-per-minute limit for llama3-8b-8192 on our plan
+TOKENS_PER_MINUTE = 30_000
+# Room left for the generated JSON when estimating a request's token cost
+COMPLETION_TOKEN_ESTIMATE = 1500
+# llama3-8b-8192 context window, and the share of it a document section may use.
+# The rest is left for the system prompt, the completion and error in estimate_tokens.
+MODEL_CONTEXT_TOKENS = 8192
+SECTION_TOKEN_LIMIT = MODEL_CONTEXT_TOKENS - COMPLETION_TOKEN_ESTIMATE - 1500
+# Long documents are sampled down to this many evenly spaced sections
+MAX_SECTIONS_PER_DOCUMENT = 8
+QUESTIONS_PER_DOCUMENT = 10
+
+QUESTION_SYSTEM_PROMPT = (
+    "You are an expert in creating multiple-choice questions for training purposes. "
+    "Based on the provided text, generate {num_questions} multiple-choice questions. "
+    "Each question must include four answer options labeled A, B, C, and D, and clearly indicate "
+    "the correct answer. Format your response strictly as a JSON list of objects, where each object has the keys: "
+    "'question', 'options', and 'answer'. Do not include any other text, explanations, or formatting outside of this JSON structure.\n"
+    "For example:\n"
+    '[{{"question": "What is ...?", "options": {{"A": "...", "B": "...", "C": "...", "D": "..."}}, "answer": "A"}}, ...]\n'
+    "Please ensure that your response is **only** in the following JSON format without any extra explanation."
+)
+
+
+class TokenBudget:
+    """
+    Sliding one-minute token budget shared by all generation threads.
+
+    acquire() blocks until the request fits in the budget. Once the response arrives,
+    settle() replaces the estimate with the real usage reported by the API.
+    """
+
+    def __init__(self, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.tokens_per_minute = tokens_per_minute
+        self._window = deque()
+        self._lock = threading.Lock()
+
+    def _used(self, now):
+        while self._window and now - self._window[0][0] >= 60:
+            self._window.popleft()
+        return sum(entry[1] for entry in self._window)
+
+    def acquire(self, tokens: int):
+        # A single request larger than the whole budget is let through on an empty window
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if self._used(now) + tokens <= self.tokens_per_minute:
+                    entry = [now, tokens]
+                    self._window.append(entry)
+                    return entry
+                wait = 60 - (now - self._window[0][0])
+            time.sleep(max(wait, 0.05))
+
+    def settle(self, entry, actual_tokens: int):
+        with self._lock:
+            entry[1] = actual_tokens
+
+
+def generate_questions(client, doc_text: str, budget=None, max_attempts=5, num_questions=QUESTIONS_PER_DOCUMENT):
+    """
+    Generate multiple-choice questions (10 by default) based on the provided document text
+    using GROQ's llama3-8b-8192. Each question should have four options labeled A, B, C, D,
+    with the correct answer indicated. The response is expected to be in JSON format,
+    a list of objects with keys: 'question', 'options', and 'answer'.
+
+    Returns (questions, errors); questions may be short of num_questions if every
+    attempt failed.
+    """
+    system_prompt = QUESTION_SYSTEM_PROMPT.format(num_questions=num_questions)
+    user_message = f"Document text:\n{doc_text}\n\nPlease generate the questions."
+    initial_request = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_message}
+    ]
+
+    def fully_valid(text):
+        valid, invalid = parse_items(text, MCQ_SCHEMA)
+        return not invalid and len(valid) >= num_questions
+
+    def complete(messages):
+        estimate = estimate_tokens("".join(m["content"] for m in messages)) + COMPLETION_TOKEN_ESTIMATE
+        entry = budget.acquire(estimate) if budget else None
+        # Re-uploading the same document reuses an earlier complete response. Repair
+        # requests always go to the API, and only fully valid responses are stored,
+        # so a broken reply is never replayed.
+        result = client.chat(
+            QUESTION_MODEL, messages, purpose="mcq_generation",
+            cache=messages is initial_request, cache_if=fully_valid,
+        )
+        if entry and result.cached:
+            budget.settle(entry, 0)
+        elif entry and result.total_tokens is not None:
+            budget.settle(entry, result.total_tokens)
+        return result.text.strip()
+
+    # Valid questions are kept from every response; only the shortfall is re-requested
+    return generate_items(
+        complete,
+        initial_request,
+        MCQ_SCHEMA,
+        count=num_questions,
+        max_attempts=max_attempts,
+        item_label=lambda q: q["question"],
+    )
+
+
+def pack_sections(chunks, token_limit=SECTION_TOKEN_LIMIT, max_sections=MAX_SECTIONS_PER_DOCUMENT):
+    """
+    Group a document's splitter chunks, in order, into sections of at most token_limit
+    tokens. If there are more than max_sections, keep an evenly spaced sample so the
+    number of requests per document is bounded as well as the size of each prompt.
+    """
+    sections, current, current_tokens = [], [], 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk)
+        if current and current_tokens + tokens > token_limit:
+            sections.append("\n".join(current))
+            current, current_tokens = [], 0
+        current.append(chunk)
+        current_tokens += tokens
+    if current:
+        sections.append("\n".join(current))
+
+    if len(sections) > max_sections:
+        step = len(sections) / max_sections
+        sections = [sections[int(i * step)] for i in range(max_sections)]
+    return sections
+
+
+def questions_per_section(num_sections: int, target=QUESTIONS_PER_DOCUMENT) -> int:
+    """Ask each section for a share of the target plus headroom for deduplication."""
+    if num_sections <= 1:
+        return target
+    return min(target, max(3, math.ceil(target * 1.5 / num_sections)))
+
+
+def _question_words(question):
+    return set(re.findall(r"[a-z0-9]+", str(question.get("question", "")).lower()))
+
+
+def merge_questions(section_results, target=QUESTIONS_PER_DOCUMENT, similarity=0.8):
+    """
+    Reduce step: drop malformed and near-duplicate questions (word-set Jaccard
+    similarity >= similarity), then take questions round-robin across sections so the
+    final set covers the whole document.
+    """
+    kept_words = []
+    unique_per_section = []
+    for questions in section_results:
+        unique = []
+        for question in questions if isinstance(questions, list) else []:
+            if not isinstance(question, dict) or not question.get("question"):
+                continue
+            words = _question_words(question)
+            if any(len(words & other) / max(len(words | other), 1) >= similarity for other in kept_words):
+                continue
+            kept_words.append(words)
+            unique.append(question)
+        unique_per_section.append(unique)
+
+    selected = []
+    for round_index in range(max((len(q) for q in unique_per_section), default=0)):
+        for questions in unique_per_section:
+            if round_index < len(questions) and len(selected) < target:
+                selected.append(questions[round_index])
+    return selected
+
+
+def generate_questions_concurrently(client, document_chunks: dict, max_workers=MAX_CONCURRENT_REQUESTS,
+                                    tokens_per_minute=TOKENS_PER_MINUTE):
+    """
+    Generate questions for several documents at once.
+
+    document_chunks maps document source to its text chunks, in order. Each document
+    is packed into context-sized sections (one section for short documents), every
+    section is sent as its own request, and the per-section questions are merged into
+    the final 10. At most max_workers requests are in flight, and all of them share one
+    tokens-per-minute budget. Yields (source, questions, errors) as each document
+    finishes.
+    """
+    if not document_chunks:
+        return
+    budget = TokenBudget(tokens_per_minute)
+
+    sections = {source: pack_sections(chunks) for source, chunks in document_chunks.items()}
+    results = {source: [None] * len(parts) for source, parts in sections.items()}
+    errors = {source: [] for source in sections}
+    pending = {source: len(parts) for source, parts in sections.items()}
+
+    total_tasks = sum(pending.values())
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, total_tasks))) as executor:
+        futures = {}
+        for source, parts in sections.items():
+            if not parts:
+                yield source, [], ["Document has no text to generate questions from."]
+                continue
+            per_section = questions_per_section(len(parts))
+            for index, text in enumerate(parts):
+                future = executor.submit(generate_questions, client, text, budget, num_questions=per_section)
+                futures[future] = (source, index)
+
+        for future in as_completed(futures):
+            source, index = futures[future]
+            questions, section_errors = future.result()
+            results[source][index] = questions
+            if len(sections[source]) > 1:
+                section_errors = [f"Section {index + 1}: {error}" for error in section_errors]
+            errors[source].extend(section_errors)
+            pending[source] -= 1
+            if pending[source] == 0:
+                yield source, merge_questions(results[source]), errors[source]
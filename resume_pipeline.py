@@ -0,0 +1,145 @@
+# resume_pipeline.py
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+from typing import Dict, List, Tuple
+
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from structured_output import recommendation_schema, generate_object
+from db_utils import get_connection, migrate_database
+
+RESUME_MODEL = "llama3-70b-8192"
+SUMMARY_PROMPT = (
+    "Summarize the resume by highlighting the user's skillset, "
+    "technical skills, and experience level."
+)
+RECOMMENDATION_SYSTEM_PROMPT = "You are an assistant that recommends relevant quizzes and scenarios based on a resume."
+
+
+def file_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def parse_resume(file_name: str, data: bytes) -> str:
+    """Extract the text of a PDF or DOC/DOCX resume. Raises ValueError for other types."""
+    file_type = file_name.split('.')[-1].lower()
+    if file_type == "pdf":
+        loader_class = PyPDFLoader
+    elif file_type in ["doc", "docx"]:
+        loader_class = Docx2txtLoader
+    else:
+        raise ValueError("Unsupported file type.")
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_type}") as tmp_file:
+        tmp_file.write(data)
+        tmp_path = tmp_file.name
+    try:
+        return "\n".join(doc.page_content for doc in loader_class(tmp_path).load())
+    finally:
+        os.remove(tmp_path)
+
+
+class ResumePipeline:
+    """
+    Parse, summarize and recommend for an uploaded resume once per file content.
+
+    Results are stored by SHA-256 of the file bytes, so Streamlit reruns (every
+    checkbox click) and other admins assigning the same candidate reuse them instead
+    of re-parsing the file and repeating the two llama3-70b calls. Only the hash, file
+    name and summary are kept, never the resume text itself. Recommendations
+    are additionally keyed by business role and the quizzes/scenarios on offer, since
+    they depend on both.
+    """
+
+    def __init__(self, db_path="database.db"):
+        self.db_path = db_path
+        self._initialize_db()
+
+    def _initialize_db(self):
+        """Ensure the resume_analyses and resume_recommendations tables exist (they are defined by the schema migrations)."""
+        migrate_database(get_connection(self.db_path, "resume_pipeline"))
+
+    def summarize(self, client, file_name: str, data: bytes) -> Tuple[str, str]:
+        """Return (content_hash, summary), parsing and summarizing only on first sight of the file."""
+        content_hash = file_hash(data)
+        with get_connection(self.db_path, "resume_pipeline") as conn:
+            row = conn.execute(
+                "SELECT summary FROM resume_analyses WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        if row:
+            return content_hash, row[0]
+
+        resume_text = parse_resume(file_name, data)
+        if not resume_text.strip():
+            return content_hash, ""
+        summary = client.complete(
+            RESUME_MODEL,
+            [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": resume_text}],
+            temperature=0.7,
+            max_tokens=1000,
+            purpose="assignments",
+        )
+        with get_connection(self.db_path, "resume_pipeline") as conn:
+            conn.execute('''
+                INSERT OR REPLACE INTO resume_analyses (content_hash, file_name, summary, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (content_hash, file_name, summary, time.time()))
+            conn.commit()
+        return content_hash, summary
+
+    def recommend(self, client, content_hash: str, summary: str, business_role: str,
+                  available_quizzes: List[str], available_scenarios: List[str],
+                  partial: Dict = None) -> Tuple[Dict, List[str]]:
+        """
+        Return (recommendation, errors) with the 'quizzes', 'scenarios' and 'reason' keys
+        that could be generated. Only complete recommendations are stored; the caller
+        keeps an incomplete one and passes it back as partial to request just the
+        missing keys.
+        """
+        options_hash = hashlib.sha256(
+            json.dumps([sorted(available_quizzes), sorted(available_scenarios)]).encode("utf-8")
+        ).hexdigest()
+        with get_connection(self.db_path, "resume_pipeline") as conn:
+            row = conn.execute('''
+                SELECT recommendation FROM resume_recommendations
+                WHERE content_hash = ? AND business_role = ? AND options_hash = ?
+            ''', (content_hash, business_role, options_hash)).fetchone()
+        if row:
+            return json.loads(row[0]), []
+
+        recommendation_prompt = (
+            "Based on the resume summary below, recommend which quizzes and scenarios are most relevant. "
+            "The resume summary is:\n"
+            f"{summary}\n\n"
+            "Available Quizzes (Document Titles):\n"
+            f"{', '.join(available_quizzes)}\n\n"
+            "Available Scenarios:\n"
+            f"{', '.join(available_scenarios)}\n\n"
+            "Return a JSON object with three keys: 'quizzes', 'scenarios', and 'reason'. "
+            "The 'quizzes' and 'scenarios' values should be lists of items from the available options that should be auto-selected, "
+            "and 'reason' should be the reason for the recommendations."
+        )
+        # Unknown quiz/scenario names are dropped; only missing or invalid keys are re-requested
+        schema = recommendation_schema(available_quizzes, available_scenarios)
+        recommendation, errors = generate_object(
+            lambda messages: client.complete(
+                RESUME_MODEL, messages, temperature=0.7, max_tokens=1000, purpose="assignments"
+            ),
+            [
+                {"role": "system", "content": RECOMMENDATION_SYSTEM_PROMPT},
+                {"role": "user", "content": recommendation_prompt}
+            ],
+            schema,
+            partial=partial,
+        )
+        if len(recommendation) == len(schema.fields):
+            with get_connection(self.db_path, "resume_pipeline") as conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO resume_recommendations
+                        (content_hash, business_role, options_hash, recommendation, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (content_hash, business_role, options_hash, json.dumps(recommendation), time.time()))
+                conn.commit()
+        return recommendation, errors
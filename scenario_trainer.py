@@ -1,13 +1,12 @@
-import sqlite3
 import streamlit as st
-import json
 import time
 import os
+from db_utils import get_connection, assigned_items
 from voice_assistant_trainer_with_voice import (
     record_audio,
     transcribe_audio,
     get_ai_response,
-    tts_threaded_playback,
+    tts_streamed_playback,
     evaluate_conversation,
 )
 
@@ -15,8 +14,7 @@ MAX_DIALOGUES = 6
 
 # ----------------------- Load Scenarios from SQLite Database -----------------------
 def load_scenarios_from_db(db_path="database.db"):
-    connection = sqlite3.connect(db_path)
-    cursor = connection.cursor()
+    cursor = get_connection(db_path).cursor()
     query = """
     SELECT id, name, conversation_type, persona_ai, persona_user, scenario_description, system_prompt, evaluation_criteria, business_role
     FROM scenarios;
@@ -37,7 +35,6 @@ def load_scenarios_from_db(db_path="database.db"):
             "evaluation_criteria": evaluation_criteria,
             "business_role": business_role
         }
-    connection.close()
     return scenarios
 
 # ----------------------- Conversation Module -----------------------
@@ -45,14 +42,8 @@ def run_conversation_module(conn, cursor, logger):
     st.title("Voice Conversation Module")
     st.write("Complete your conversation exercise by selecting a scenario and interacting with the AI below.")
 
-    # 1. Fetch assigned scenarios for the current user from the assignments table.
-    cursor.execute("SELECT scenarios FROM assignments WHERE user_id = ?", (st.session_state.username,))
-    row = cursor.fetchone()
-    if row:
-        # Assuming the 'scenarios' column is stored as a JSON list of scenario names.
-        assigned_scenarios = json.loads(row[0])
-    else:
-        assigned_scenarios = []
+    # 1. Fetch the scenarios assigned to the current user across all of their assignments.
+    assigned_scenarios = assigned_items(cursor, st.session_state.username, "scenario")
 
     # 2. Load all scenarios from the database.
     all_scenarios = load_scenarios_from_db("database.db")
@@ -103,13 +94,30 @@ def run_conversation_module(conn, cursor, logger):
             user_text = transcribe_audio(audio_file)
             st.write(f"**{scenario['persona_user']} said:**", user_text)
             
-            # Generate AI response using conversation history and the system prompt from the scenario
-            ai_response = get_ai_response(
+            # Generate AI response using conversation history and the system prompt from the scenario.
+            # The reply is streamed: text renders token by token and speech starts after the first sentence.
+            reply = get_ai_response(
                 user_text,
                 st.session_state.messages_history,
-                scenario["system_prompt"]
+                scenario["system_prompt"],
+                stream=True
+            )
+            response_placeholder = st.empty()
+
+            def render_as_it_arrives(deltas):
+                for delta in deltas:
+                    yield delta
+                    response_placeholder.markdown(f"**{scenario['persona_ai']} says:** {reply.text}")
+
+            # Plays the AI response using TTS (blocks until playback is complete)
+            tts_streamed_playback(render_as_it_arrives(reply), voice="af_heart", max_chunk_length=100)
+            ai_response = reply.text
+            logger.log_event(
+                user_id=st.session_state.username,
+                page="Conversation Module",
+                action="Response Latency",
+                details=reply.latency_details()
             )
-            st.write(f"**{scenario['persona_ai']} says:**", ai_response)
             
             # Append messages to history for later evaluation
             st.session_state.messages_history.extend([
@@ -117,9 +125,6 @@ def run_conversation_module(conn, cursor, logger):
                 {"role": "assistant", "content": ai_response}
             ])
             
-            # Play the AI response using TTS (this function blocks until playback is complete)
-            tts_threaded_playback(ai_response, voice="af_heart", max_chunk_length=100)
-            
             # Clean up the temporary audio file
             if os.path.exists(audio_file):
                 os.remove(audio_file)
@@ -1,66 +1,14 @@
 # seed_dummy_data.py
-import sqlite3
 import random
 import uuid
 from datetime import datetime, timedelta
+from db_utils import get_connection, close_connections, initialize_database
 
-conn = sqlite3.connect("database.db")
+conn = get_connection()
 cursor = conn.cursor()
 
 # Create required tables
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS results (
-        id TEXT PRIMARY KEY,
-        document_title TEXT,
-        business_role TEXT,
-        score INTEGER,
-        total INTEGER,
-        submission_time TEXT
-    )
-""")
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS chat_logs (
-        id TEXT,
-        business_role TEXT,
-        message TEXT,
-        timestamp TEXT
-    )
-""")
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY,
-        username TEXT UNIQUE NOT NULL,
-        password TEXT NOT NULL,
-        system_role TEXT NOT NULL,
-        business_role TEXT NOT NULL,
-        department TEXT,
-        start_date TEXT
-    )
-""")
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS questions (
-        id INTEGER PRIMARY KEY,
-        document_title TEXT,
-        business_role TEXT,
-        question TEXT,
-        options TEXT,
-        answer TEXT
-    )
-""")
-
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS settings (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )
-""")
-
-cursor.execute("SELECT * FROM settings WHERE key = 'quiz_deadline_days'")
-if cursor.fetchone() is None:
-    cursor.execute("INSERT INTO settings (key, value) VALUES (?, ?)", ("quiz_deadline_days", "7"))
+initialize_database(conn)
 
 # Role-to-department and role-to-documents mapping
 role_dept_map = {
@@ -116,9 +64,9 @@ for username, role in compliant_users:
         score = random.randint(70, 100)
         submitted = today - timedelta(days=random.randint(1, 6))
         cursor.execute("""
-            INSERT INTO results (id, document_title, business_role, score, total, submission_time)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (result_id, doc, role, score, 100, submitted.strftime("%Y-%m-%d %H:%M:%S")))
+            INSERT INTO results (id, username, user_id, document_title, business_role, score, total, submission_time)
+            VALUES (?, ?, (SELECT id FROM users WHERE username = ?), ?, ?, ?, ?, ?)
+        """, (result_id, username, username, doc, role, score, 100, submitted.strftime("%Y-%m-%d %H:%M:%S")))
 
 # Insert questions for each doc per role
 sample_question = "What is the purpose of this document?"
@@ -152,5 +100,5 @@ for role in roles:
         """, (user_id, role, message, timestamp.strftime("%Y-%m-%d %H:%M:%S")))
 
 conn.commit()
-conn.close()
+close_connections()
 print("Dummy data seeded successfully!")
@@ -0,0 +1,315 @@
+# structured_output.py
+#
+# Shared parsing, validation and repair of JSON produced by the LLM. Instead of
+# regenerating a whole response when part of it is malformed, valid pieces are kept
+# and only the missing or invalid pieces are asked for again.
+
+import json
+import time
+from typing import Callable, Dict, List
+
+OPTION_KEYS = ["A", "B", "C", "D"]
+
+
+class Schema:
+    """
+    Expected shape of an LLM response.
+
+    fields maps each key to a validator that returns the cleaned value or raises
+    ValueError. The same schema describes one object (generate_object) or each
+    object of a list (generate_items).
+    """
+
+    def __init__(self, name: str, fields: Dict[str, Callable]):
+        self.name = name
+        self.fields = fields
+
+    def validate(self, obj):
+        """Return (cleaned fields, {field: error}) for one object."""
+        if not isinstance(obj, dict):
+            return {}, {field: "missing" for field in self.fields}
+        cleaned, errors = {}, {}
+        for field, validator in self.fields.items():
+            if field not in obj:
+                errors[field] = "missing"
+                continue
+            try:
+                cleaned[field] = validator(obj[field])
+            except (ValueError, TypeError) as e:
+                errors[field] = str(e)
+        return cleaned, errors
+
+
+# ----------------------- Validators -----------------------
+def non_empty_string(value):
+    if not isinstance(value, str) or not value.strip():
+        raise ValueError("expected a non-empty string")
+    return value.strip()
+
+
+def string_list(value):
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list):
+        raise ValueError("expected a list of strings")
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def mcq_options(value):
+    # Accept a plain list of four options as well as the {"A": ..., "D": ...} form
+    if isinstance(value, list) and len(value) == len(OPTION_KEYS):
+        value = dict(zip(OPTION_KEYS, value))
+    if not isinstance(value, dict):
+        raise ValueError("expected options A-D")
+    options = {str(key).strip().upper().rstrip(".):"): str(text).strip() for key, text in value.items()}
+    if sorted(options) != OPTION_KEYS or not all(options.values()):
+        raise ValueError("expected exactly four non-empty options labeled A-D")
+    return options
+
+
+def mcq_answer(value):
+    answer = str(value).strip().upper()[:1]
+    if answer not in OPTION_KEYS:
+        raise ValueError("answer must be one of A, B, C, D")
+    return answer
+
+
+def choices_from(allowed):
+    """Validator for a list restricted to known options; unknown items are dropped rather than failing."""
+    allowed = set(allowed)
+
+    def validator(value):
+        return [item for item in string_list(value) if item in allowed]
+    return validator
+
+
+# ----------------------- Schemas -----------------------
+MCQ_SCHEMA = Schema("multiple-choice question", {
+    "question": non_empty_string,
+    "options": mcq_options,
+    "answer": mcq_answer,
+})
+
+SCENARIO_FIELDS = [
+    "name", "conversation_type", "persona_ai", "persona_user",
+    "scenario_description", "system_prompt", "evaluation_criteria",
+]
+SCENARIO_SCHEMA = Schema("scenario", {field: non_empty_string for field in SCENARIO_FIELDS})
+
+
+def recommendation_schema(available_quizzes, available_scenarios):
+    return Schema("recommendation", {
+        "quizzes": choices_from(available_quizzes),
+        "scenarios": choices_from(available_scenarios),
+        "reason": non_empty_string,
+    })
+
+
+# ----------------------- Parsing -----------------------
+def _next_opener(text: str, openers: str, start: int) -> int:
+    positions = [p for p in (text.find(o, start) for o in openers) if p != -1]
+    return min(positions) if positions else -1
+
+
+def _decode_values(text: str, openers: str = "[{"):
+    """Every top-level JSON value starting with one of openers that decodes cleanly, left to right."""
+    decoder = json.JSONDecoder()
+    values, position = [], _next_opener(text, openers, 0)
+    while position != -1:
+        try:
+            value, end = decoder.raw_decode(text, position)
+            values.append(value)
+            position = _next_opener(text, openers, end)
+        except json.JSONDecodeError:
+            position = _next_opener(text, openers, position + 1)
+    return values
+
+
+def extract_json(text: str):
+    """
+    Pull the JSON payload out of a model response that may be wrapped in prose or code
+    fences. Returns the largest value that decodes, or None if nothing does.
+    """
+    text = (text or "").strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    values = _decode_values(text)
+    return max(values, key=lambda v: len(json.dumps(v))) if values else None
+
+
+def _item_starts(text: str) -> List[int]:
+    """
+    Positions of the "{" that open a top-level object or an element of a list, skipping
+    objects nested as a value inside another object (such as an item's options).
+    """
+    starts, stack, in_string, escaped = [], [], False, False
+    for position, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "[{":
+            if char == "{" and (not stack or stack[-1] == "["):
+                starts.append(position)
+            stack.append(char)
+        elif char in "]}" and stack:
+            stack.pop()
+    return starts
+
+
+def _decode_items(text: str):
+    """Every list element or top-level object that decodes on its own, left to right."""
+    decoder = json.JSONDecoder()
+    values, end = [], 0
+    for start in _item_starts(text):
+        if start < end:
+            continue
+        try:
+            value, end = decoder.raw_decode(text, start)
+            values.append(value)
+        except json.JSONDecodeError:
+            pass
+    return values
+
+
+def _is_item_list(value) -> bool:
+    return isinstance(value, list) and any(isinstance(item, dict) for item in value)
+
+
+def parse_items(text: str, schema: Schema):
+    """
+    Salvage the valid objects from a list response, including the complete objects of
+    a truncated list. Returns (valid_items, invalid_count).
+    """
+    payload = extract_json(text)
+    if isinstance(payload, dict):
+        # Some responses wrap the list, e.g. {"questions": [...]}; any other dict is
+        # just the largest complete item, not the payload
+        payload = next((v for v in payload.values() if _is_item_list(v)), None)
+    if not _is_item_list(payload):
+        # Truncated or broken list: fall back to whichever items decode on their own
+        payload = _decode_items(text or "")
+    return _validate_all(payload, schema)
+
+
+def _validate_all(objects, schema):
+    valid, invalid = [], 0
+    for obj in objects:
+        cleaned, errors = schema.validate(obj)
+        if errors:
+            invalid += 1
+        else:
+            valid.append(cleaned)
+    return valid, invalid
+
+
+def parse_object(text: str, schema: Schema):
+    """Return (valid fields, {field: error}) for a single-object response."""
+    payload = extract_json(text)
+    if isinstance(payload, list):
+        payload = next((v for v in payload if isinstance(v, dict)), None)
+    return schema.validate(payload)
+
+
+# ----------------------- Generation with repair -----------------------
+def _call(complete, messages, errors, attempts_left, retry_delay):
+    """Call the model, retrying transient API errors. Returns None once attempts run out."""
+    while attempts_left[0] > 0:
+        attempts_left[0] -= 1
+        try:
+            return complete(messages)
+        except Exception as e:
+            errors.append(f"Unexpected error: {e}")
+            if attempts_left[0] > 0:
+                time.sleep(retry_delay)
+    return None
+
+
+def generate_items(complete: Callable, messages: List[Dict], schema: Schema, count: int,
+                   max_attempts=5, retry_delay=2, item_label=lambda item: json.dumps(item)):
+    """
+    Ask for a list of count objects. Valid objects from each response are kept; if
+    some are missing or invalid, a short repair request asks for just that many more,
+    listing what is already accepted so the model does not repeat it.
+
+    complete(messages) -> str performs one model call. Returns (items, errors).
+    """
+    items, errors = [], []
+    attempts_left = [max_attempts]
+    request = messages
+
+    while len(items) < count:
+        text = _call(complete, request, errors, attempts_left, retry_delay)
+        if text is None:
+            break
+        valid, invalid = parse_items(text, schema)
+        items.extend(valid[:count - len(items)])
+        if invalid or not valid:
+            errors.append(f"Discarded {invalid} invalid {schema.name}(s); kept {len(valid)}.")
+        missing = count - len(items)
+        if missing <= 0 or attempts_left[0] <= 0:
+            break
+        accepted = "\n".join(f"- {item_label(item)}" for item in items) or "- (none yet)"
+        request = messages + [{
+            "role": "user",
+            "content": (
+                f"Generate exactly {missing} more {schema.name}(s) in the same JSON list format. "
+                f"Do not repeat any of these already accepted ones:\n{accepted}\n"
+                "Respond with only the JSON list."
+            ),
+        }]
+
+    if len(items) < count:
+        errors.append(f"Only {len(items)} of {count} valid {schema.name}(s) could be generated.")
+    return items, errors
+
+
+def _repair_object_request(messages, result, missing):
+    return messages + [{
+        "role": "user",
+        "content": (
+            f"Return a JSON object with only these keys: {', '.join(missing)}. "
+            "Keep it consistent with this partial result:\n"
+            f"{json.dumps(result)}\n"
+            "Respond with only the JSON object."
+        ),
+    }]
+
+
+def generate_object(complete: Callable, messages: List[Dict], schema: Schema, max_attempts=3, retry_delay=2,
+                    partial: Dict = None):
+    """
+    Ask for a single object. Valid fields are kept and a repair request asks only for
+    the fields that were missing or invalid. Pass the fields of an earlier incomplete
+    result as partial to ask only for the rest. Returns (fields, errors); fields may be
+    incomplete if the attempts run out.
+    """
+    result, errors = dict(partial or {}), []
+    attempts_left = [max_attempts]
+    missing = [field for field in schema.fields if field not in result]
+    if not missing:
+        return result, errors
+    request = _repair_object_request(messages, result, missing) if result else messages
+
+    while True:
+        text = _call(complete, request, errors, attempts_left, retry_delay)
+        if text is None:
+            break
+        cleaned, field_errors = parse_object(text, schema)
+        result.update({k: v for k, v in cleaned.items() if k not in result})
+        missing = [field for field in schema.fields if field not in result]
+        if not missing:
+            return result, errors
+        errors.append(f"Invalid or missing {schema.name} fields: {', '.join(missing)}.")
+        if attempts_left[0] <= 0:
+            break
+        request = _repair_object_request(messages, result, missing)
+
+    return result, errors
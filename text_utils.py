@@ -0,0 +1,8 @@
+# text_utils.py
+#
+# Small text helpers shared by the generation, chat and retrieval modules.
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for English text)."""
+    return len(text) // 4 + 1
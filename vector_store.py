@@ -0,0 +1,537 @@
+# vector_store.py
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from typing import Dict
+
+from langchain_core.documents import Document
+from langchain_huggingface import HuggingFaceEmbeddings
+
+from db_utils import get_connection
+from embedding_cache import CachedEmbeddings
+from hybrid_search import lexical_search, reciprocal_rank_fusion
+from index_backends import (
+    BACKENDS,
+    INDEX_BACKEND,
+    INDEX_MMAP,
+    build_index,
+    shard_needs_rebuild,
+    index_backend_name,
+    index_memory_bytes,
+    is_index_mapped,
+    read_vector_store,
+    vector_store_from_index,
+)
+
+# Root directory of the index; each business role has its own shard underneath it
+INDEX_PATH = "faiss_index"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+# Documents uploaded for this role are searched for every employee
+COMPANY_WIDE_ROLE = "Company-wide"
+
+
+def content_hash(text: str) -> str:
+    """SHA-256 of a chunk's text, used to recognise chunks that are already indexed."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def shard_path(business_role, index_root=INDEX_PATH):
+    """Directory of the FAISS shard holding one business role's chunks."""
+    name = re.sub(r"[^a-z0-9]+", "_", (business_role or "").lower()).strip("_") or "unassigned"
+    return os.path.join(index_root, name)
+
+
+def search_roles(business_role):
+    """The shards an employee with this business role may retrieve from."""
+    if not business_role or business_role == COMPANY_WIDE_ROLE:
+        return [COMPANY_WIDE_ROLE]
+    return [business_role, COMPANY_WIDE_ROLE]
+
+
+def load_index(embeddings, index_path, mmap=False):
+    """
+    Load a FAISS shard from disk, or return None if it has not been built yet.
+    Pass mmap=True for read-only searching; writers need a regular in-memory copy.
+    """
+    if not os.path.exists(os.path.join(index_path, "index.faiss")):
+        return None
+    return read_vector_store(index_path, embeddings, mmap=mmap)
+
+
+def save_index_atomic(vector_store, index_path):
+    """
+    Write the index to a sibling temp directory and swap it into place, so readers
+    never load a half-written index.faiss / index.pkl pair. The shard is briefly
+    missing between the two renames; VectorStoreService keeps its loaded copy then.
+    """
+    parent = os.path.dirname(os.path.abspath(index_path))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".faiss_tmp_", dir=parent)
+    try:
+        vector_store.save_local(tmp_dir)
+        old_dir = None
+        if os.path.exists(index_path):
+            old_dir = tempfile.mkdtemp(prefix=".faiss_old_", dir=parent)
+            os.rmdir(old_dir)
+            os.replace(index_path, old_dir)
+        os.replace(tmp_dir, index_path)
+        if old_dir:
+            shutil.rmtree(old_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def _is_legacy_index(vector_store) -> bool:
+    # Indexes written before incremental indexing used random UUIDs instead of processed_docs ids.
+    return any(not str(doc_id).isdigit() for doc_id in vector_store.index_to_docstore_id.values())
+
+
+def rebuild_index(cursor, embeddings, business_role, index_root=INDEX_PATH, backend=INDEX_BACKEND,
+                  vectors_by_hash=None):
+    """
+    Rebuild one role's shard from processed_docs with the configured index backend.
+    Used to repair a missing or legacy shard, to convert a shard to another backend,
+    and to retrain one that has outgrown its IVF cells (see shard_needs_rebuild).
+
+    Inside a write transaction pass vectors_by_hash (content hash -> vector) computed
+    beforehand: the embedding cache writes on its own connection and would wait on
+    the caller's lock.
+    """
+    cursor.execute(
+        "SELECT id, page_content, content_hash, source, page, chunk_index FROM processed_docs WHERE business_role = ?",
+        (business_role,)
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+
+    docs, ids = [], []
+    for row_id, page_content, chunk_hash, source, page, chunk_index in rows:
+        docs.append(Document(
+            page_content=page_content,
+            metadata={
+                "chunk_id": row_id,
+                "business_role": business_role,
+                "content_hash": chunk_hash or content_hash(page_content),
+                "source": source,
+                "page": page,
+                "chunk_index": chunk_index,
+            },
+        ))
+        ids.append(str(row_id))
+
+    index_path = shard_path(business_role, index_root)
+    if vectors_by_hash is None:
+        vectors = embeddings.embed_documents([doc.page_content for doc in docs])
+    else:
+        vectors = _vectors_for(docs, vectors_by_hash, embeddings)
+    index, _ = build_index(vectors, backend, index_root=index_root, shard_name=os.path.basename(index_path))
+    vector_store = vector_store_from_index(index, docs, ids, embeddings)
+    save_index_atomic(vector_store, index_path)
+    return vector_store
+
+
+def migrate_legacy_index(cursor, embeddings, index_root=INDEX_PATH) -> bool:
+    """
+    Split a single global index (index.faiss directly under index_root) into per-role
+    shards rebuilt from processed_docs, then remove it. Returns True if it migrated.
+    """
+    legacy_file = os.path.join(index_root, "index.faiss")
+    if not os.path.exists(legacy_file):
+        return False
+    cursor.execute("SELECT DISTINCT business_role FROM processed_docs")
+    for (business_role,) in cursor.fetchall():
+        rebuild_index(cursor, embeddings, business_role, index_root)
+    for name in ("index.faiss", "index.pkl"):
+        path = os.path.join(index_root, name)
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+def _vectors_for(docs, vectors_by_hash, embeddings):
+    """
+    Vectors of docs from vectors_by_hash. Chunks missing from it (stored by another
+    writer since it was computed) are embedded with the underlying model, bypassing
+    the cache's writes, since the caller holds the SQLite write lock.
+    """
+    missing = [doc for doc in docs if doc.metadata["content_hash"] not in vectors_by_hash]
+    if missing:
+        model = getattr(embeddings, "base", embeddings)
+        for doc, vector in zip(missing, model.embed_documents([doc.page_content for doc in missing])):
+            vectors_by_hash[doc.metadata["content_hash"]] = vector
+    return [vectors_by_hash[doc.metadata["content_hash"]] for doc in docs]
+
+
+def _existing_hashes(cursor, business_role, hash_list):
+    """The given content hashes already stored for this business role."""
+    existing = set()
+    # In slices that stay under SQLite's variable limit
+    for start in range(0, len(hash_list), 500):
+        batch = hash_list[start:start + 500]
+        placeholders = ",".join("?" * len(batch))
+        cursor.execute(
+            f"SELECT content_hash FROM processed_docs WHERE business_role = ? AND content_hash IN ({placeholders})",
+            [business_role] + batch,
+        )
+        existing.update(row[0] for row in cursor.fetchall())
+    return existing
+
+
+def index_documents(cursor, processed_docs, business_role, embeddings, index_root=INDEX_PATH):
+    """
+    Incrementally add a batch of chunks to processed_docs and the business role's shard.
+
+    Chunks whose content hash is already stored for this business role are skipped, new
+    chunks are inserted into processed_docs and added to the shard under their row id,
+    and the shard is saved atomically. Only the new chunks are embedded. The caller
+    commits the SQLite transaction once this returns, so a failed index write leaves
+    neither store changed.
+
+    Everything is embedded before the write transaction is opened: the embedding cache
+    writes on its own connection, and WAL allows one writer at a time.
+
+    Returns the list of chunks that were actually added.
+    """
+    # Position of each chunk within its source document, before duplicates are dropped
+    chunk_counters = {}
+    for doc in processed_docs:
+        source = doc.metadata.get("source", "")
+        doc.metadata["chunk_index"] = chunk_counters.get(source, 0)
+        chunk_counters[source] = doc.metadata["chunk_index"] + 1
+
+    hashes = {}
+    for doc in processed_docs:
+        chunk_hash = content_hash(doc.page_content)
+        if chunk_hash not in hashes:
+            hashes[chunk_hash] = doc
+
+    # A legacy global index is split into role shards first, outside any write lock
+    migrate_legacy_index(cursor, embeddings, index_root)
+
+    existing = _existing_hashes(cursor, business_role, list(hashes))
+    candidates = {chunk_hash: doc for chunk_hash, doc in hashes.items() if chunk_hash not in existing}
+    if not candidates:
+        return []
+
+    index_path = shard_path(business_role, index_root)
+    vector_store = load_index(embeddings, index_path)
+    needs_rebuild = (
+        vector_store is None
+        or _is_legacy_index(vector_store)
+        or shard_needs_rebuild(vector_store.index, vector_store.index.ntotal + len(candidates))
+    )
+
+    # Embed the new chunks (and for a rebuild, the role's stored chunks) up front
+    texts = {chunk_hash: doc.page_content for chunk_hash, doc in candidates.items()}
+    if needs_rebuild:
+        cursor.execute("SELECT content_hash, page_content FROM processed_docs WHERE business_role = ?", (business_role,))
+        for chunk_hash, page_content in cursor.fetchall():
+            texts.setdefault(chunk_hash or content_hash(page_content), page_content)
+    vectors_by_hash = dict(zip(texts, embeddings.embed_documents(list(texts.values()))))
+
+    # Take the write lock so the row ids assigned below cannot collide, and re-check
+    # for chunks another writer stored since the lookup above
+    if not cursor.connection.in_transaction:
+        cursor.execute("BEGIN IMMEDIATE")
+    existing = _existing_hashes(cursor, business_role, list(candidates))
+
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM processed_docs")
+    next_id = cursor.fetchone()[0] + 1
+
+    new_docs, new_ids, rows = [], [], []
+    for chunk_hash, doc in candidates.items():
+        if chunk_hash in existing:
+            continue
+        rows.append((
+            next_id,
+            doc.page_content,
+            json.dumps(doc.metadata, default=str),
+            business_role,
+            chunk_hash,
+            doc.metadata.get("source", ""),
+            doc.metadata.get("page"),
+            doc.metadata["chunk_index"],
+        ))
+        doc.metadata["chunk_id"] = next_id
+        doc.metadata["business_role"] = business_role
+        doc.metadata["content_hash"] = chunk_hash
+        new_docs.append(doc)
+        new_ids.append(str(next_id))
+        next_id += 1
+
+    # One executemany inside the caller's transaction instead of a statement per chunk
+    cursor.executemany('''
+        INSERT INTO processed_docs (id, page_content, metadata, business_role, content_hash, source, page, chunk_index)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+    if not new_docs:
+        return []
+
+    # processed_docs already holds the new rows, so a rebuild picks them up too
+    if needs_rebuild:
+        rebuild_index(cursor, embeddings, business_role, index_root, vectors_by_hash=vectors_by_hash)
+        return new_docs
+
+    # An earlier run that saved the shard but crashed before its SQLite commit left
+    # vectors whose ids are not this role's rows. Row ids are global, so such an id
+    # may since belong to another role's chunk (or be reused by this batch): keep
+    # only ids of rows this role already had before this batch.
+    cursor.execute("SELECT id FROM processed_docs WHERE business_role = ?", (business_role,))
+    stored_ids = {str(row[0]) for row in cursor.fetchall()} - set(new_ids)
+    stale_ids = [doc_id for doc_id in vector_store.docstore._dict if doc_id not in stored_ids]
+    if stale_ids:
+        vector_store.delete(ids=stale_ids)
+
+    vector_store.add_embeddings(
+        [(doc.page_content, vectors_by_hash[doc.metadata["content_hash"]]) for doc in new_docs],
+        metadatas=[doc.metadata for doc in new_docs],
+        ids=new_ids,
+    )
+    save_index_atomic(vector_store, index_path)
+    return new_docs
+
+
+class VectorStoreService:
+    """
+    One embedding model and set of FAISS shards shared by every Streamlit session in the process.
+
+    The model is loaded lazily on first use and wrapped in the persistent embedding
+    cache, so chunks that were embedded before are never sent through the model again.
+    Each role's shard is reloaded automatically when its index.faiss on disk changes
+    (e.g. after an upload), and searches always go through the current copy, so
+    sessions never hold stale retrievers.
+    """
+
+    def __init__(self, index_root=INDEX_PATH, model_name=EMBEDDING_MODEL_NAME, db_path="database.db"):
+        self.index_root = index_root
+        self.model_name = model_name
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._embeddings = None
+        # shard path -> (disk signature, vector store)
+        self._shards = {}
+        self._stats = {
+            "model_load_seconds": None,
+            "index_load_seconds": None,
+            "index_loads": 0,
+            "searches": 0,
+        }
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    start = time.perf_counter()
+                    self._embeddings = CachedEmbeddings(
+                        HuggingFaceEmbeddings(model_name=self.model_name),
+                        model_name=self.model_name,
+                        db_path=self.db_path,
+                    )
+                    self._stats["model_load_seconds"] = time.perf_counter() - start
+        return self._embeddings
+
+    @staticmethod
+    def _disk_signature(index_path):
+        try:
+            stat = os.stat(os.path.join(index_path, "index.faiss"))
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _shard_signature(self, index_path):
+        """
+        The shard's disk signature, or the loaded copy's while the file is missing.
+        Shards are never deleted, so a missing file after a load means save_index_atomic
+        is between its two renames; the previous copy stays current until the new one lands.
+        """
+        signature = self._disk_signature(index_path)
+        if signature is None:
+            return self._shards.get(index_path, (None, None))[0]
+        return signature
+
+    def _migrate_legacy(self):
+        if not os.path.exists(os.path.join(self.index_root, "index.faiss")):
+            return
+        with self._lock:
+            migrate_legacy_index(get_connection(self.db_path).cursor(), self.embeddings, self.index_root)
+
+    def get_vector_store(self, business_role):
+        """Return the role's current shard, reloading it if the file on disk has changed."""
+        self._migrate_legacy()
+        index_path = shard_path(business_role, self.index_root)
+        signature = self._shard_signature(index_path)
+        cached_signature, vector_store = self._shards.get(index_path, (None, None))
+        if signature == cached_signature:
+            return vector_store
+        with self._lock:
+            signature = self._shard_signature(index_path)
+            cached_signature, vector_store = self._shards.get(index_path, (None, None))
+            if signature != cached_signature:
+                start = time.perf_counter()
+                try:
+                    vector_store = load_index(self.embeddings, index_path, mmap=INDEX_MMAP) if signature else None
+                except (OSError, RuntimeError):
+                    # Caught mid-swap by an upload; keep serving the previous copy and retry next call
+                    return vector_store
+                self._shards[index_path] = (signature, vector_store)
+                self._stats["index_load_seconds"] = time.perf_counter() - start
+                self._stats["index_loads"] += 1
+            return vector_store
+
+    def index_version(self, business_role=None) -> str:
+        """
+        Identifies the on-disk state of every shard the role searches. It changes
+        whenever one of them is rewritten, so caches derived from retrieval can
+        tell that they are stale.
+        """
+        signatures = [self._shard_signature(shard_path(role, self.index_root)) for role in search_roles(business_role)]
+        return hashlib.sha256(repr(signatures).encode("utf-8")).hexdigest()[:16]
+
+    def has_index(self, business_role=None) -> bool:
+        return any(self.get_vector_store(role) is not None for role in search_roles(business_role))
+
+    def get_relevant_documents(self, query: str, k: int = 5, business_role=None, mode="hybrid", query_vector=None):
+        """
+        Top-k chunks for the query from the caller's role shard and the company-wide
+        shard only. The query is embedded once (or query_vector reused, if the caller
+        already has it) and the shard results merged by distance. In "hybrid" mode the
+        vector results are fused with BM25 matches from the FTS5 table over the same
+        roles, so exact terms are found without widening k.
+        """
+        roles = search_roles(business_role)
+        self._stats["searches"] += 1
+
+        vector_docs = []
+        shards = [vs for vs in (self.get_vector_store(role) for role in roles) if vs]
+        if shards:
+            if query_vector is None:
+                query_vector = self.embeddings.embed_query(query)
+            scored = []
+            for vector_store in shards:
+                scored.extend(vector_store.similarity_search_with_score_by_vector(query_vector, k=k))
+            scored.sort(key=lambda pair: pair[1])
+            vector_docs = [doc for doc, _ in scored[:k]]
+        if mode != "hybrid":
+            return vector_docs
+
+        lexical_docs = lexical_search(get_connection(self.db_path), query, roles, k=k)
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], k=k)
+
+    def chunk_vectors(self, docs):
+        """
+        Stored vectors of retrieved chunks, for re-ranking on the answer path. Read from
+        the embedding cache without touching it, or else reconstructed from the chunk's
+        shard; None where neither has it. Never runs the embedding model.
+        """
+        vectors = self.embeddings.cached_vectors([doc.page_content for doc in docs])
+        for i, doc in enumerate(docs):
+            if vectors[i] is None:
+                vectors[i] = self._reconstruct(doc)
+        return vectors
+
+    def _reconstruct(self, doc):
+        vector_store = self.get_vector_store(doc.metadata.get("business_role"))
+        chunk_id = str(doc.metadata.get("chunk_id"))
+        if vector_store is None:
+            return None
+        position = next((p for p, doc_id in vector_store.index_to_docstore_id.items() if doc_id == chunk_id), None)
+        if position is None:
+            return None
+        try:
+            return vector_store.index.reconstruct(int(position)).tolist()
+        except RuntimeError:
+            return None  # e.g. an IVF index without a direct map
+
+    def stats(self) -> Dict:
+        """Load times, search count and memory usage for the admin page."""
+        stats = dict(self._stats)
+        shards = [vs for _, vs in self._shards.values() if vs is not None]
+        stats["num_shards"] = len(shards)
+        stats["num_vectors"] = sum(vs.index.ntotal for vs in shards)
+        stats["index_memory_mb"] = sum(index_memory_bytes(vs.index) for vs in shards) / 1024 ** 2
+        stats["index_backends"] = sorted({index_backend_name(vs.index) for vs in shards})
+        # Counted per loaded index: FAISS_INDEX_MMAP only takes effect for ivfpq shards
+        stats["mapped_shards"] = sum(is_index_mapped(vs.index) for vs in shards)
+        stats["process_rss_mb"] = _process_rss_mb()
+        stats["embedding_cache"] = self._embeddings.stats() if self._embeddings is not None else None
+        return stats
+
+
+def _process_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        # ru_maxrss is the peak, in KB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def rebuild_shards(db_path="database.db", roles=None, backend=INDEX_BACKEND, index_root=INDEX_PATH):
+    """
+    Rebuild the shards of the given business roles (default: every role in
+    processed_docs) with backend. Returns the roles rebuilt.
+
+    The chunks are embedded first, then the shard is built and saved under the
+    SQLite write lock, so an ingestion worker cannot add to it meanwhile.
+    """
+    conn = get_connection(db_path)
+    cursor = conn.cursor()
+    if roles is None:
+        cursor.execute("SELECT DISTINCT business_role FROM processed_docs")
+        roles = [row[0] for row in cursor.fetchall()]
+    embeddings = VectorStoreService(index_root, db_path=db_path).embeddings
+    rebuilt = []
+    for business_role in roles:
+        cursor.execute("SELECT content_hash, page_content FROM processed_docs WHERE business_role = ?", (business_role,))
+        texts = {chunk_hash or content_hash(text): text for chunk_hash, text in cursor.fetchall()}
+        if not texts:
+            continue
+        vectors_by_hash = dict(zip(texts, embeddings.embed_documents(list(texts.values()))))
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            rebuild_index(cursor, embeddings, business_role, index_root, backend, vectors_by_hash=vectors_by_hash)
+        finally:
+            conn.rollback()  # nothing was written to SQLite; this only releases the lock
+        rebuilt.append(business_role)
+    return rebuilt
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_vector_service() -> VectorStoreService:
+    """Process-wide VectorStoreService singleton."""
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = VectorStoreService()
+    return _service
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild FAISS shards from processed_docs.")
+    parser.add_argument("--rebuild", action="store_true", required=True)
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--role", action="append", help="Business role to rebuild (repeatable; default: all)")
+    parser.add_argument("--backend", default=INDEX_BACKEND, choices=BACKENDS, help="Index backend (default: FAISS_INDEX_BACKEND)")
+    args = parser.parse_args()
+
+    for business_role in rebuild_shards(args.db, args.role, args.backend):
+        print(f"Rebuilt {shard_path(business_role)} ({business_role})")
@@ -8,9 +8,10 @@ import platform
 import threading
 import queue
 import re
-from groq import Groq
 import soundfile as sf
 from kokoro import KPipeline
+from llm_gateway import get_llm_gateway
+from llm_streaming import StreamedCompletion
 
 # Variable setup
 MAX_DIALOGUES = 6
@@ -136,18 +137,48 @@ def tts_threaded_playback(text, voice, max_chunk_length):
     processor_thread.join()
     player_thread.join()
 
+def stream_sentence_chunks(deltas, max_length=100):
+    """Group streamed text into speakable chunks, yielding each as soon as its sentence ends."""
+    buffer = ""
+    for delta in deltas:
+        buffer += delta
+        sentences = re.split(r'(?<=[.!?])\s+', buffer)
+        if len(sentences) > 1:
+            buffer = sentences[-1]
+            yield from chunk_text_by_sentences(" ".join(sentences[:-1]), max_length=max_length)
+    if buffer.strip():
+        yield from chunk_text_by_sentences(buffer, max_length=max_length)
+
+def tts_streamed_playback(deltas, voice, max_chunk_length):
+    """
+    Speak a streamed response while it is still being generated: deltas are consumed
+    in the calling thread and each completed sentence is handed to the TTS threads.
+    """
+    chunk_queue = queue.Queue()
+    audio_queue = queue.Queue()
+    processor_thread = threading.Thread(target=process_audio, args=(iter(chunk_queue.get, None), audio_queue, voice))
+    player_thread = threading.Thread(target=play_audio_worker, args=(audio_queue,))
+    processor_thread.start()
+    player_thread.start()
+    try:
+        for chunk in stream_sentence_chunks(deltas, max_length=max_chunk_length):
+            chunk_queue.put(chunk)
+    finally:
+        chunk_queue.put(None)
+        processor_thread.join()
+        player_thread.join()
+
 # ----------------------- LLM Setup -----------------------
-client = Groq(api_key=os.environ["GROQ_API_KEY"])
+client = get_llm_gateway()
 
-def get_ai_response(message, messages_history, system_prompt):
+def get_ai_response(message, messages_history, system_prompt, stream=False):
+    """Full reply text, or with stream=True a StreamedCompletion yielding tokens as they arrive."""
     messages = [{"role": "system", "content": system_prompt}] + messages_history + [{"role": "user", "content": message}]
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=messages,
-        temperature=0.7,
-        max_tokens=1000
-    )
-    return response.choices[0].message.content.strip()
+    if stream:
+        return StreamedCompletion(
+            client, messages, model="llama3-70b-8192", temperature=0.7, max_tokens=1000, purpose="voice_trainer"
+        )
+    return client.complete("llama3-70b-8192", messages, temperature=0.7, max_tokens=1000, purpose="voice_trainer")
 
 def evaluate_conversation(messages_history, scenario):
     transcript = ""
@@ -168,13 +199,13 @@ Please evaluate the [{scenario['persona_user']}]’s performance using the follo
 Please keep your evaluation succinct as you are delivering this over speech.
     """
 
-    response = client.chat.completions.create(
-        model="llama3-70b-8192",
-        messages=[{"role": "user", "content": evaluation_prompt}],
+    return client.complete(
+        "llama3-70b-8192",
+        [{"role": "user", "content": evaluation_prompt}],
         temperature=0.7,
-        max_tokens=1000
+        max_tokens=1000,
+        purpose="voice_evaluation",
     )
-    return response.choices[0].message.content.strip()
 
 # ----------------------- Main Loop -----------------------
 def voice_conversation(scenario, max_dialogues=MAX_DIALOGUES): 
@@ -187,16 +218,18 @@ def voice_conversation(scenario, max_dialogues=MAX_DIALOGUES):
         user_text = transcribe_audio(audio_file)
         print("You said:", user_text)
 
-        ai_response = get_ai_response(user_text, messages_history, system_prompt)
+        # Playback starts with the first complete sentence instead of after the whole reply
+        reply = get_ai_response(user_text, messages_history, system_prompt, stream=True)
+        tts_streamed_playback(reply, voice=AI_VOICE, max_chunk_length=MAX_CHUNK_LENGTH)
+        ai_response = reply.text
         print(f"{scenario['persona_ai']}:", ai_response)
+        print(f"({reply.latency_details()})")
 
         messages_history.extend([
             {"role": "user", "content": user_text},
             {"role": "assistant", "content": ai_response}
         ])
 
-        tts_threaded_playback(ai_response, voice=AI_VOICE, max_chunk_length=MAX_CHUNK_LENGTH)
-
         os.remove(audio_file)
         dialogue_count += 1
         print("\n--------------------------------\n")